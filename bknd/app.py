@@ -4,20 +4,47 @@ import sys
 import json
 import hashlib
 import math
+import gzip
+import threading
+import time
+import random
+import uuid
+from functools import lru_cache, wraps
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from io import BytesIO
 import matplotlib.pyplot as plt
+import numpy as np
 import io
 import base64
 
-from flask import Flask, request, jsonify, make_response
+import click
+from flask import Flask, request, jsonify, make_response, send_file, current_app
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib import colors
-from sqlalchemy import func, case
+from sqlalchemy import func, case, select, delete, update, cast, literal, insert, or_, and_, create_engine
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
+
+from iot_queue import IoTWriteBehindQueue
+from evidence_store import EvidenceStore, ChecksumMismatch
+import evidence_store
+import federated
+import portfolio_risk
+import replay
+
+try:
+    import orjson
+except ImportError:  # Optional fast encoder; Flask's default json provider is used without it
+    orjson = None
 
 # --- CRITICAL CONFIGURATION ---
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -27,6 +54,68 @@ VERCEL_ORIGIN = "*"
 # Database configuration for local SQLite
 DB_NAME = 'genfin_demo.db'
 SQLITE_URI = f'sqlite:///{os.path.join(PROJECT_ROOT, DB_NAME)}'
+# Closed seasons are moved out of the hot tables into one compressed file per season
+ARCHIVE_DIR = os.path.join(PROJECT_ROOT, 'archive')
+
+# --- IoT Write-Behind Ingest (set GENFIN_IOT_WRITE_BEHIND=1 to queue readings instead of committing per call) ---
+IOT_WRITE_BEHIND = os.environ.get('GENFIN_IOT_WRITE_BEHIND', '0') == '1'
+# Only the serving process drains the queue (GENFIN_IOT_CONSUMER=1, or a separate `flask iot-consumer`);
+# CLI commands such as init-db build the same app and must not start the consumer thread
+IOT_CONSUMER = os.environ.get('GENFIN_IOT_CONSUMER', '0') == '1'
+IOT_QUEUE_PATH = os.environ.get('GENFIN_IOT_QUEUE_PATH', os.path.join(PROJECT_ROOT, 'iot_queue.db'))
+IOT_BATCH_SIZE = int(os.environ.get('GENFIN_IOT_BATCH_SIZE', 500))
+IOT_FLUSH_INTERVAL = float(os.environ.get('GENFIN_IOT_FLUSH_INTERVAL', 0.5))  # Seconds the consumer idles when the queue is empty
+IOT_QUEUE_MAX_DEPTH = int(os.environ.get('GENFIN_IOT_QUEUE_MAX_DEPTH', 100000))  # Ingest answers 503 above this depth
+IOT_MAX_ATTEMPTS = int(os.environ.get('GENFIN_IOT_MAX_ATTEMPTS', 5))  # Failed batches after which readings are dead-lettered
+IOT_SEASON_CACHE_TTL = 60.0     # Seconds a farmer's known hot season id is trusted by write-behind ingest
+IOT_SEASON_CACHE_SIZE = 10000
+DROUGHT_MOISTURE_THRESHOLD = 25.0
+
+# --- Insurance ---
+# Payout is 10% of the sum insured (the total potential loan); both are stored on the policy when it is bound
+INSURANCE_PAYOUT_RATE = 0.10
+CLAIMS_PAGE_SIZE = 50
+
+# --- Evidence Uploads (content-addressed; see evidence_store.py) ---
+EVIDENCE_DIR = os.environ.get('GENFIN_EVIDENCE_DIR', os.path.join(PROJECT_ROOT, 'evidence'))
+UPLOAD_MAX_FILE_SIZE = int(os.environ.get('GENFIN_UPLOAD_MAX_FILE_SIZE', 100 * 1024 * 1024))
+UPLOAD_MAX_CHUNK_SIZE = int(os.environ.get('GENFIN_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Suggested chunk size for phones on slow links
+
+# --- State Replay (`flask rebuild-state`) ---
+REPLAY_SNAPSHOT_INTERVAL = 100  # Re-snapshot a season once this many new contract entries were folded
+REPLAY_BATCH_SEASONS = 2000     # Seasons per parallel replay job
+REPLAY_TIME_TOLERANCE = 2.0     # Seconds; routes set live dates a moment before logging the transition
+
+# --- Contract History ---
+CONTRACT_HISTORY_EMBED = 10  # Latest entries embedded in the status payload
+CONTRACT_PAGE_SIZE = 50      # Default page size of /api/farmer/<id>/contracts
+
+# --- Federated FPS Model (written by `flask fl-train`; the mock formula is used until it exists) ---
+FPS_MODEL_PATH = os.path.join(PROJECT_ROOT, 'models', 'fps_model.json')
+
+# --- API JSON encoder: 'orjson' (used when installed) or 'default' (Flask's json module) ---
+JSON_ENCODER = os.environ.get('GENFIN_JSON_ENCODER', 'orjson')
+
+# --- Stage Templates ---
+LOAN_PER_ACRE = 200  # Mock loan amount: $200 per acre
+DEFAULT_TEMPLATE_CROP = '*'  # Fallback schedule used when a crop has no template of its own
+# Stage roles the routes act on, wherever a crop schedule places them (each at most once per schedule)
+STAGE_ROLE_PREMIUM = 'INSURANCE_PREMIUM'  # Disbursing this stage binds the season's insurance policy
+STAGE_ROLE_PEST = 'PEST_CONTROL'          # Conditional stage: skipped unless a pest event was logged
+STAGE_ROLES = (STAGE_ROLE_PREMIUM, STAGE_ROLE_PEST)
+# +++ STAGE NAMES ALIGNED WITH BRS: (stage_number, stage_name, share of total loan, initial status, role) +++
+DEFAULT_STAGE_TEMPLATE = [
+    (1, "Stage 1: Soil Test", 0.10, 'UNLOCKED', None),
+    (2, "Stage 2: Inputs (Seed/Fertilizer)", 0.35, 'LOCKED', None),
+    (3, "Stage 3: Insurance Premium", 0.05, 'LOCKED', STAGE_ROLE_PREMIUM),
+    (4, "Stage 4: Weeding/Maintenance", 0.15, 'LOCKED', None),
+    (5, "Stage 5: Pest Control (Conditional)", 0.10, 'LOCKED', STAGE_ROLE_PEST),
+    (6, "Stage 6: Packaging", 0.15, 'LOCKED', None),
+    (7, "Stage 7: Transport/Marketing", 0.10, 'LOCKED', None),
+]
+LOAN_STAGE_STATUSES = ('LOCKED', 'UNLOCKED', 'PENDING', 'APPROVED', 'COMPLETED')
+TEMPLATE_INITIAL_STATUSES = ('LOCKED', 'UNLOCKED')  # A new season starts with only its first stage UNLOCKED
 
 # --- Database Initialization ---
 db = SQLAlchemy()
@@ -41,6 +130,8 @@ class Farmer(db.Model):
     age = db.Column(db.Integer)
     next_of_kin = db.Column(db.String(100))
     registration_date = db.Column(db.DateTime, default=datetime.utcnow)
+    erased_date = db.Column(db.DateTime, nullable=True)  # Set when PII was redacted under a POPIA erasure request
+    cooperative = db.Column(db.String(100), index=True)  # Federated learning client the farmer's data belongs to
 
     # Relationships (Updated to Season model)
     seasons = db.relationship('Season', backref='farmer', lazy=True, cascade="all, delete-orphan")
@@ -57,6 +148,15 @@ class Farmer(db.Model):
         season = self.current_season
         if not season:
             return {'total_disbursed': 0.0, 'score': 50, 'risk_band': 'MEDIUM', 'xai_factors': [], 'pest_flag': False}
+        if season.is_archived:
+            summary = season.summary
+            return {
+                'total_disbursed': summary.final_disbursed,
+                'score': summary.final_score if summary.final_score is not None else 50,
+                'risk_band': summary.risk_band or 'MEDIUM',
+                'xai_factors': summary.xai_factors or [],
+                'pest_flag': summary.pest_flag
+            }
         # Get latest scorecard
         scorecard = season.scorecards[-1] if season.scorecards else None
         # Calculate total disbursed
@@ -81,13 +181,19 @@ class Season(db.Model):
     crop = db.Column(db.String(50))
     start_date = db.Column(db.DateTime, default=datetime.utcnow)
     end_date = db.Column(db.DateTime)
+    stage_template_version = db.Column(db.Integer)  # Version of the StageTemplate the stages were built from
 
     # Relationships
     stages = db.relationship('LoanStage', backref='season', lazy=True, cascade="all, delete-orphan")
-    contracts = db.relationship('Contract', backref='season', lazy=True, cascade="all, delete-orphan")
+    contracts = db.relationship('Contract', backref='season', lazy=True, cascade="all, delete-orphan", order_by='(Contract.timestamp, Contract.id)')
     scorecards = db.relationship('Scorecard', backref='season', lazy=True, cascade="all, delete-orphan")
     policies = db.relationship('Policy', backref='season', lazy=True, cascade="all, delete-orphan")
     iot_logs = db.relationship('IoTLog', backref='season', lazy=True, cascade="all, delete-orphan")
+    summary = db.relationship('SeasonSummary', backref='season', uselist=False, lazy=True, cascade="all, delete-orphan")
+
+    @property
+    def is_archived(self):
+        return self.summary is not None
 
     def __repr__(self):
         return f"Season('{self.farmer.name}', '{self.crop}')"
@@ -104,43 +210,58 @@ class Plot(db.Model):
 
 
 class LoanStage(db.Model):
+    __table_args__ = (
+        db.Index('ix_loan_stage_season_number', 'season_id', 'stage_number'),
+        db.Index('ix_loan_stage_status_number', 'status', 'stage_number'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     season_id = db.Column(db.Integer, db.ForeignKey('season.id'), nullable=False)
     stage_number = db.Column(db.Integer, nullable=False)
     stage_name = db.Column(db.String(100), nullable=False)
     status = db.Column(db.String(20), default='LOCKED')  # LOCKED, UNLOCKED, PENDING, APPROVED, COMPLETED
+    role = db.Column(db.String(20))  # STAGE_ROLE_PREMIUM / STAGE_ROLE_PEST from the stage template, else None
     disbursement_amount = db.Column(db.Float, nullable=False)
     completed_date = db.Column(db.DateTime, nullable=True)
+    # Optimistic concurrency: every UPDATE is "... WHERE id=? AND version=?" and bumps the version
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
 
     @classmethod
-    def get_initial_stages(cls, season_id):
-        """Creates the initial 7 stages for a new loan season."""
-        season = Season.query.get(season_id)
-        if not season or not season.farmer.plots:
+    def get_initial_stages(cls, season, plot_size):
+        """Creates the initial stages for a new loan season from the crop's stage template."""
+        if plot_size is None:
             raise Exception("Cannot create stages without a Season and Plot.")
-        plot_size = season.farmer.plots[0].size
-        total_loan = plot_size * 200  # Mock loan amount: $200 per acre
-
-        # +++ UPDATED STAGE NAMES TO ALIGN WITH BRS +++
-        stages_data = [
-            ("Stage 1: Soil Test", 0.10 * total_loan, 'UNLOCKED'),  # 10%
-            ("Stage 2: Inputs (Seed/Fertilizer)", 0.35 * total_loan, 'LOCKED'),  # 35%
-            ("Stage 3: Insurance Premium", 0.05 * total_loan, 'LOCKED'),  # 5%
-            ("Stage 4: Weeding/Maintenance", 0.15 * total_loan, 'LOCKED'),  # 15%
-            ("Stage 5: Pest Control (Conditional)", 0.10 * total_loan, 'LOCKED'),  # 10%
-            ("Stage 6: Packaging", 0.15 * total_loan, 'LOCKED'),  # 15%
-            ("Stage 7: Transport/Marketing", 0.10 * total_loan, 'LOCKED'),  # 10%
-        ]
-        stages = []
-        for i, (name, amount, status) in enumerate(stages_data):
-            stages.append(cls(
-                season_id=season_id,
-                stage_number=i + 1,
+        version, template = get_stage_template(season.crop)
+        season.stage_template_version = version
+        total_loan = plot_size * LOAN_PER_ACRE
+        return [
+            cls(
+                season_id=season.id,
+                stage_number=number,
                 stage_name=name,
                 status=status,
-                disbursement_amount=amount
-            ))
-        return stages
+                role=role,
+                disbursement_amount=share * total_loan
+            ) for number, name, share, status, role in template
+        ]
+
+
+class StageTemplate(db.Model):
+    """One stage of a versioned disbursement schedule. Each (crop, version) pair forms a full schedule."""
+    __table_args__ = (
+        db.UniqueConstraint('crop', 'version', 'stage_number', name='uq_stage_template_crop_version_number'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    crop = db.Column(db.String(50), nullable=False, default=DEFAULT_TEMPLATE_CROP, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    stage_number = db.Column(db.Integer, nullable=False)
+    stage_name = db.Column(db.String(100), nullable=False)
+    share = db.Column(db.Float, nullable=False)  # Fraction of the total loan released at this stage
+    initial_status = db.Column(db.String(20), nullable=False, default='LOCKED')
+    role = db.Column(db.String(20))  # One of STAGE_ROLES, or None for a plain disbursement stage
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class FileUpload(db.Model):
@@ -150,16 +271,42 @@ class FileUpload(db.Model):
     stage_number = db.Column(db.Integer, nullable=False)
     file_type = db.Column(db.String(50), nullable=False)  # e.g., 'soil_test', 'photo_evidence'
     file_name = db.Column(db.String(255))
+    sha256 = db.Column(db.LargeBinary(32), index=True)  # Content address in the evidence store (None for metadata-only uploads)
+    size = db.Column(db.Integer)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class UploadSession(db.Model):
+    """A resumable evidence upload in progress; the received bytes live in the evidence store's partial file."""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, part of the upload URL
+    farmer_id = db.Column(db.Integer, db.ForeignKey('farmer.id'), nullable=False)
+    season_id = db.Column(db.Integer, db.ForeignKey('season.id'), nullable=False)
+    stage_number = db.Column(db.Integer, nullable=False)
+    file_type = db.Column(db.String(50), nullable=False)
+    file_name = db.Column(db.String(255))
+    size = db.Column(db.Integer, nullable=False)  # Declared total size in bytes
+    sha256 = db.Column(db.LargeBinary(32))  # Optional client-declared digest, verified on completion
+    soil_data = db.Column(db.JSON)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Contract(db.Model):
+    __table_args__ = (
+        # Chain head lookups and cursor-paginated history per season, in (timestamp, id) order
+        db.Index('ix_contract_season_timestamp', 'season_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     season_id = db.Column(db.Integer, db.ForeignKey('season.id'), nullable=False)
     state = db.Column(db.String(50), nullable=False)  # DRAFT, ACTIVE, STAGE_1_PENDING, STAGE_1_COMPLETED, etc.
-    hash_value = db.Column(db.String(255), nullable=False)  # Mock Smart Contract Hash
+    hash_value = db.Column(db.LargeBinary(32), nullable=False)  # Mock Smart Contract Hash (raw SHA-256 digest)
+    evidence_sha256 = db.Column(db.LargeBinary(32))  # Uploaded file behind a STAGE_n_PENDING transition
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def hash_hex(self):
+        return self.hash_value.hex()
+
 
 class Scorecard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -171,11 +318,23 @@ class Scorecard(db.Model):
 
 
 class Policy(db.Model):
+    __table_args__ = (
+        # Claims work-queue: status filter + oldest-first keyset pagination on (claim_date, id)
+        db.Index('ix_policy_status_claim_date', 'status', 'claim_date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     season_id = db.Column(db.Integer, db.ForeignKey('season.id'), nullable=False)
     policy_id = db.Column(db.String(50), unique=True)
     triggers = db.Column(db.JSON)  # e.g., {"rainfall": "<10mm", "pest_flag": "True"}
     status = db.Column(db.String(50), default='PENDING')  # PENDING, ACTIVE, CLAIM_PENDING, CLAIM_APPROVED, CLAIM_REJECTED, CLAIMED
+    sum_insured = db.Column(db.Float, nullable=False, default=0.0)  # Total potential loan at binding
+    payout_amount = db.Column(db.Float, nullable=False, default=0.0)  # sum_insured * INSURANCE_PAYOUT_RATE
+    premium = db.Column(db.Float, nullable=False, default=0.0)  # Disbursed Stage 3 (Insurance Premium) amount
+    bound_date = db.Column(db.DateTime, nullable=True)
+    claim_date = db.Column(db.DateTime, nullable=True)  # When the policy last moved to CLAIM_PENDING
+    version = db.Column(db.Integer, nullable=False, default=1)  # Optimistic concurrency (see LoanStage.version)
+    __mapper_args__ = {'version_id_col': version}
 
 
 class IoTLog(db.Model):
@@ -185,47 +344,905 @@ class IoTLog(db.Model):
     data = db.Column(db.JSON)  # Mock sensor data (e.g., {'ph': 7.0, 'moisture': 25, 'pest_detected': True})
 
 
+class SeasonSummary(db.Model):
+    """Hot-schema summary kept for a closed season whose detail rows were moved to the archive."""
+    season_id = db.Column(db.Integer, db.ForeignKey('season.id'), primary_key=True)
+    total_loan = db.Column(db.Float, nullable=False, default=0.0)
+    final_disbursed = db.Column(db.Float, nullable=False, default=0.0)
+    defaulted = db.Column(db.Boolean, nullable=False, default=False, index=True)
+    final_score = db.Column(db.Float)
+    risk_band = db.Column(db.String(20))
+    xai_factors = db.Column(db.JSON)
+    pest_flag = db.Column(db.Boolean, nullable=False, default=False)
+    drought_flag = db.Column(db.Boolean, nullable=False, default=False)
+    final_contract_state = db.Column(db.String(50))
+    chain_head_hash = db.Column(db.LargeBinary(32))
+    archive_file = db.Column(db.String(255), nullable=False)
+    archived_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SeasonSnapshot(db.Model):
+    """
+    Season state folded from the contract log up to (and including) one entry, refreshed by `flask rebuild-state`.
+    Replay resumes after it. Derived data only: it is dropped when the season is archived or erased.
+    """
+    season_id = db.Column(db.Integer, db.ForeignKey('season.id'), primary_key=True)
+    last_contract_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    head_hash = db.Column(db.LargeBinary(32), nullable=False)  # Hash of the last folded entry, re-checked before resuming
+    events = db.Column(db.Integer, nullable=False)  # Contract entries folded into this snapshot
+    engine_version = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.JSON, nullable=False)
+    created_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class IdempotencyRecord(db.Model):
+    """
+    A mutation accepted under an Idempotency-Key. The row is inserted in the same transaction as the mutation's
+    writes, so the unique constraint lets exactly one attempt commit across all workers and restarts.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('idempotency_key', 'method', 'path', name='uq_idempotency_key_method_path'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(255), nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.LargeBinary(32), nullable=False)  # SHA-256 of the request body
+    status_code = db.Column(db.Integer)  # None while the first attempt is still running
+    response_body = db.Column(db.LargeBinary)
+    content_type = db.Column(db.String(100))
+    created_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
 # --- UTILITY FUNCTIONS ---
-def transition_contract_state(season_id, new_state, data=None):
-    """Simulates a smart contract state transition and logs the event/hash."""
-    contract = Contract.query.filter_by(season_id=season_id).order_by(Contract.timestamp.desc()).first()
+# In-memory cache of published stage schedules: {(crop, version): (version, [(number, name, share, status, role), ...])}
+# A published version never changes, so entries stay valid; the newest version is looked up on every call, which
+# lets every worker process pick up a schedule published by another one at once.
+_stage_template_cache = {}
+
+
+def get_stage_template(crop):
+    """Returns (version, stages) for the newest template of a crop, falling back to the default schedule."""
+    key = (crop or DEFAULT_TEMPLATE_CROP).lower()
+    for candidate in (key, DEFAULT_TEMPLATE_CROP):
+        version = db.session.query(func.max(StageTemplate.version)).filter(StageTemplate.crop == candidate).scalar()
+        if version is None:
+            continue
+        if (candidate, version) not in _stage_template_cache:
+            rows = StageTemplate.query.filter_by(crop=candidate, version=version).order_by(StageTemplate.stage_number).all()
+            _stage_template_cache[(candidate, version)] = (version, [(r.stage_number, r.stage_name, r.share, r.initial_status, r.role) for r in rows])
+        return _stage_template_cache[(candidate, version)]
+    # No templates stored yet (e.g. database created before templates existed)
+    return 0, list(DEFAULT_STAGE_TEMPLATE)
+
+
+def seed_default_stage_template():
+    """Stores DEFAULT_STAGE_TEMPLATE as version 1 of the fallback schedule if it is not present."""
+    if StageTemplate.query.filter_by(crop=DEFAULT_TEMPLATE_CROP).first():
+        return
+    db.session.add_all([
+        StageTemplate(crop=DEFAULT_TEMPLATE_CROP, version=1, stage_number=number, stage_name=name, share=share, initial_status=status, role=role)
+        for number, name, share, status, role in DEFAULT_STAGE_TEMPLATE
+    ])
+    db.session.commit()
+
+
+def validate_stage_template(stages):
+    """
+    Returns an error message for a schedule the routes cannot run, or None. `stages` is a sorted list of
+    (stage_number, stage_name, share, initial_status, role).
+    """
+    numbers = [number for number, _, _, _, _ in stages]
+    if numbers != list(range(1, len(stages) + 1)):
+        return 'Stage numbers must run 1..N without gaps (each completion unlocks the next number).'
+    for number, name, share, status, role in stages:
+        if not str(name).strip():
+            return f'Stage {number} needs a name.'
+        if share <= 0:
+            return f'Stage {number} share must be greater than 0.'
+        if status not in LOAN_STAGE_STATUSES:
+            return f"Stage {number} initial_status must be one of {', '.join(LOAN_STAGE_STATUSES)}."
+        if status not in TEMPLATE_INITIAL_STATUSES:
+            return f"Stage {number} cannot start as {status}; use {' or '.join(TEMPLATE_INITIAL_STATUSES)}."
+        if role is not None and role not in STAGE_ROLES:
+            return f"Stage {number} role must be one of {', '.join(STAGE_ROLES)} or null."
+    if [number for number, _, _, status, _ in stages if status == 'UNLOCKED'] != [1]:
+        return 'Exactly one stage, Stage 1, must start UNLOCKED.'
+    if abs(sum(share for _, _, share, _, _ in stages) - 1.0) > 1e-6:
+        return 'Stage shares must add up to 1.0.'
+    for role in STAGE_ROLES:
+        if sum(1 for *_, r in stages if r == role) > 1:
+            return f'At most one stage can have the {role} role.'
+    pest = next((number for number, *_, role in stages if role == STAGE_ROLE_PEST), None)
+    if pest is not None and not 1 < pest < len(stages):
+        return f'The {STAGE_ROLE_PEST} stage is skipped into the stage after it, so it cannot be the first or last stage.'
+    return None
+
+
+def archived_season_response(season):
+    """409 for a write aimed at an archived season: its rows and hash chain were moved to the archive file."""
+    return jsonify({'message': f'Season {season.id} is archived and read-only.'}), 409
+
+
+def transition_contract_state(season_id, new_state, data=None, commit=True, evidence_sha256=None):
+    """Simulates a smart contract state transition and logs the event/hash. Returns the new log entry."""
+    contract = Contract.query.filter_by(season_id=season_id).order_by(Contract.timestamp.desc(), Contract.id.desc()).first()
     if not contract:
+        if db.session.get(SeasonSummary, season_id) is not None:
+            # The chain head lives in the archive; a new genesis entry here would fork the chain
+            raise ValueError(f'Season {season_id} is archived and read-only.')
         # For initial contract creation
-        initial_hash = hashlib.sha256(f"{season_id}_{new_state}_{data or ''}_{datetime.utcnow()}".encode()).hexdigest()
-        new_contract_log = Contract(season_id=season_id, state=new_state, hash_value=initial_hash)
+        new_contract_log = Contract(season_id=season_id, state=new_state, evidence_sha256=evidence_sha256,
+                                    hash_value=contract_hash(None, season_id, new_state, data, datetime.utcnow()))
         db.session.add(new_contract_log)
-        db.session.commit()
-        return
+        if commit:
+            db.session.commit()
+        return new_contract_log
 
     # Generate new hash based on the previous hash, new state, and timestamp (Immutable Audit Trail)
-    new_hash_input = f"{contract.hash_value}_{new_state}_{data or ''}_{datetime.utcnow()}"
-    new_hash = hashlib.sha256(new_hash_input.encode()).hexdigest()
+    new_hash = contract_hash(contract.hash_value, season_id, new_state, data, datetime.utcnow())
 
     # Log the new state transition
     new_contract_log = Contract(
         season_id=season_id,
         state=new_state,
         hash_value=new_hash,
+        evidence_sha256=evidence_sha256,
         timestamp=datetime.utcnow()
     )
     db.session.add(new_contract_log)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+    return new_contract_log
+
+
+# Detail tables moved out of the hot schema when a season is archived
+ARCHIVED_MODELS = (('stages', LoanStage), ('contracts', Contract), ('scorecards', Scorecard), ('iot_logs', IoTLog))
+
+
+def _row_to_dict(row):
+    values = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.name)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, bytes):
+            value = value.hex()
+        values[column.name] = value
+    return values
+
+
+def _dict_to_row(model, values):
+    """Rebuilds a detached (never added to the session) model instance from archived column values."""
+    kwargs = {}
+    for column in model.__table__.columns:
+        value = values.get(column.name)
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, db.LargeBinary):
+            value = bytes.fromhex(value)
+        kwargs[column.name] = value
+    return model(**kwargs)
+
+
+@lru_cache(maxsize=64)
+def _load_archive_file(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+class SeasonRecords:
+    """Per-table access to a season's detail rows; live relationships are only loaded when first requested."""
+
+    def __init__(self, season):
+        self.season = season
+        self._archived = None
+
+    def __getitem__(self, name):
+        if not self.season.is_archived:
+            return getattr(self.season, name)
+        if self._archived is None:
+            self._archived = _load_archive_file(os.path.join(ARCHIVE_DIR, self.season.summary.archive_file))
+        model = dict(ARCHIVED_MODELS)[name]
+        return [_dict_to_row(model, values) for values in self._archived.get(name, [])]
+
+
+def season_records(season):
+    """Returns the season's stages, contracts, scorecards and IoT logs, reading archived seasons from disk."""
+    return SeasonRecords(season)
+
+
+def season_defaulted(stages):
+    """
+    Default flag of a season at its end_date: its final stage was never completed. Stages unlock in order,
+    so a conditional stage that was skipped (left LOCKED) counts as done. Same rule as get_lender_kpis.
+    """
+    if not stages:
+        return False
+    return max(stages, key=lambda st: st.stage_number).status != 'COMPLETED'
+
+
+def archive_closed_seasons(before=None, batch_size=200, dry_run=False):
+    """
+    Moves seasons that ended before `before` (default and upper bound: now, so running seasons stay hot) out of the hot tables.
+    Seasons with a CLAIM_PENDING policy are skipped until the claim is reviewed.
+    Each season's detail rows are written to ARCHIVE_DIR/season_<id>.json.gz, a SeasonSummary row is kept
+    in the hot schema and the detail rows are deleted set-wise, one transaction per batch.
+    Returns the number of seasons archived (or that would be archived when dry_run is set).
+    """
+    before = min(before or datetime.utcnow(), datetime.utcnow())
+    # A season with an open claim stays hot until the insurer settles it (archived seasons are read-only)
+    open_claims = db.session.query(Policy.season_id).filter(Policy.status == 'CLAIM_PENDING')
+    candidates = db.session.query(Season.id).outerjoin(SeasonSummary).filter(
+        Season.end_date < before, SeasonSummary.season_id.is_(None), Season.id.notin_(open_claims)
+    ).order_by(Season.id)
+    if dry_run:
+        return candidates.count()
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archived = 0
+    while True:
+        season_ids = [sid for (sid,) in candidates.limit(batch_size).all()]
+        if not season_ids:
+            break
+        grouped = {sid: {name: [] for name, _ in ARCHIVED_MODELS} for sid in season_ids}
+        for name, model in ARCHIVED_MODELS:
+            order = (model.timestamp, model.id) if model is Contract else (model.id,)
+            for row in model.query.filter(model.season_id.in_(season_ids)).order_by(model.season_id, *order):
+                grouped[row.season_id][name].append(row)
+
+        for sid in season_ids:
+            rows = grouped[sid]
+            stages, contracts, scorecards = rows['stages'], rows['contracts'], rows['scorecards']
+            head = contracts[-1] if contracts else None
+            scorecard = scorecards[-1] if scorecards else None
+            file_name = f'season_{sid}.json.gz'
+            tmp_path = os.path.join(ARCHIVE_DIR, file_name + '.tmp')
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as fh:
+                json.dump({name: [_row_to_dict(r) for r in records] for name, records in rows.items()}, fh)
+            os.replace(tmp_path, os.path.join(ARCHIVE_DIR, file_name))
+            db.session.add(SeasonSummary(
+                season_id=sid,
+                total_loan=sum(st.disbursement_amount for st in stages),
+                final_disbursed=sum(st.disbursement_amount for st in stages if st.status == 'COMPLETED'),
+                defaulted=season_defaulted(stages),
+                final_score=scorecard.score if scorecard else None,
+                risk_band=scorecard.risk_band if scorecard else None,
+                xai_factors=scorecard.xai_factors if scorecard else None,
+                pest_flag=any(log.data and log.data.get('pest_detected') for log in rows['iot_logs']),
+                drought_flag=any(log.data and log.data.get('drought_detected') for log in rows['iot_logs']),
+                final_contract_state=head.state if head else None,
+                chain_head_hash=head.hash_value if head else None,
+                archive_file=file_name
+            ))
+
+        for _, model in ARCHIVED_MODELS:
+            model.query.filter(model.season_id.in_(season_ids)).delete(synchronize_session=False)
+        SeasonSnapshot.query.filter(SeasonSnapshot.season_id.in_(season_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expire_all()
+        archived += len(season_ids)
+    _load_archive_file.cache_clear()
+    return archived
+
+
+# Season-owned tables in deletion order (children before Season itself)
+SEASON_CHILD_MODELS = (IoTLog, Contract, Scorecard, Policy, LoanStage, FileUpload, UploadSession, SeasonSummary, SeasonSnapshot)
+ERASURE_CHUNK_SIZE = 500
+
+
+def erase_farmers(farmer_ids, redact=False, dry_run=False, chunk_size=ERASURE_CHUNK_SIZE):
+    """
+    POPIA erasure for many farmers using set-based statements, one transaction per chunk of farmer ids.
+    Default mode deletes every dependent row (DELETE ... WHERE season_id IN (...)) in dependency order.
+    With redact=True the farmer's PII, plot locations and file names are scrubbed instead, leaving seasons,
+    stages and the contract hash chain in place for audit. In both modes evidence files no other farmer
+    uploaded and partial uploads are removed from the evidence store.
+    Returns per-table row counts (affected rows, or matching rows when dry_run is set).
+    """
+    farmer_ids = sorted({int(fid) for fid in farmer_ids})
+    counts = {}
+
+    def record(name, result_or_count):
+        counts[name] = counts.get(name, 0) + (result_or_count if isinstance(result_or_count, int) else result_or_count.rowcount)
+
+    for start in range(0, len(farmer_ids), chunk_size):
+        chunk = farmer_ids[start:start + chunk_size]
+        season_ids = select(Season.id).where(Season.farmer_id.in_(chunk))
+        if not dry_run:
+            digests = {d for (d,) in db.session.query(FileUpload.sha256).filter(FileUpload.farmer_id.in_(chunk), FileUpload.sha256.isnot(None))}
+            shared = {d for (d,) in db.session.query(FileUpload.sha256).filter(FileUpload.sha256.in_(digests), FileUpload.farmer_id.notin_(chunk))} if digests else set()
+            sessions = [sid for (sid,) in db.session.query(UploadSession.id).filter(UploadSession.farmer_id.in_(chunk))]
+        try:
+            if dry_run:
+                record('farmer', db.session.query(func.count(Farmer.id)).filter(Farmer.id.in_(chunk)).scalar())
+                record('plot', db.session.query(func.count(Plot.id)).filter(Plot.farmer_id.in_(chunk)).scalar())
+                if redact:
+                    record('file_upload', db.session.query(func.count(FileUpload.id)).filter(FileUpload.farmer_id.in_(chunk)).scalar())
+                    continue
+                for model in SEASON_CHILD_MODELS:
+                    key = model.__table__.c.season_id
+                    record(model.__tablename__, db.session.query(func.count()).select_from(model).filter(key.in_(season_ids)).scalar())
+                record('season', db.session.query(func.count(Season.id)).filter(Season.farmer_id.in_(chunk)).scalar())
+                continue
+
+            if redact:
+                record('farmer', db.session.execute(
+                    update(Farmer).where(Farmer.id.in_(chunk)).values(
+                        name='REDACTED', phone=literal('REDACTED-').concat(cast(Farmer.id, db.String)), id_document=None,
+                        gender=None, age=None, next_of_kin=None, erased_date=datetime.utcnow()
+                    ).execution_options(synchronize_session=False)))
+                record('plot', db.session.execute(
+                    update(Plot).where(Plot.farmer_id.in_(chunk)).values(geo_tag=None).execution_options(synchronize_session=False)))
+                record('file_upload', db.session.execute(
+                    update(FileUpload).where(FileUpload.farmer_id.in_(chunk)).values(file_name=None).execution_options(synchronize_session=False)))
+                record('upload_session', db.session.execute(
+                    delete(UploadSession).where(UploadSession.farmer_id.in_(chunk)).execution_options(synchronize_session=False)))
+            else:
+                archive_files = [name for (name,) in db.session.query(SeasonSummary.archive_file).filter(SeasonSummary.season_id.in_(season_ids))]
+                for model in SEASON_CHILD_MODELS:
+                    key = model.__table__.c.season_id
+                    record(model.__tablename__, db.session.execute(
+                        delete(model).where(key.in_(season_ids)).execution_options(synchronize_session=False)))
+                record('season', db.session.execute(
+                    delete(Season).where(Season.farmer_id.in_(chunk)).execution_options(synchronize_session=False)))
+                record('plot', db.session.execute(
+                    delete(Plot).where(Plot.farmer_id.in_(chunk)).execution_options(synchronize_session=False)))
+                record('farmer', db.session.execute(
+                    delete(Farmer).where(Farmer.id.in_(chunk)).execution_options(synchronize_session=False)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if not dry_run and not redact:
+            for name in archive_files:
+                path = os.path.join(ARCHIVE_DIR, name)
+                if os.path.exists(path):
+                    os.remove(path)
+        if not dry_run:
+            store = current_app.extensions['evidence_store']
+            for digest in digests - shared:
+                if store.exists(digest.hex()):
+                    os.remove(store.path(digest.hex()))
+            for session_id in sessions:
+                store.discard(session_id)
+    if not dry_run:
+        db.session.expire_all()
+    return counts
+
+
+def record_stage_upload(season, stage, file_type, file_name, soil_data=None, sha256=None, size=None):
+    """
+    Records an upload for an UNLOCKED stage: the FileUpload row, the stage moving to PENDING, the soil-test
+    score update and the STAGE_n_PENDING transition, which carries the evidence digest when a file was
+    stored. The caller commits.
+    """
+    stage_number = stage.stage_number
+    digest_note = f' sha256={sha256.hex()}' if sha256 else ''
+
+    # 1. File Upload record (content lives in the evidence store when sha256 is set)
+    upload = FileUpload(
+        farmer_id=season.farmer_id,
+        season_id=season.id,
+        stage_number=stage_number,
+        file_type=file_type,
+        file_name=file_name,
+        sha256=sha256,
+        size=size
+    )
+    db.session.add(upload)
+
+    # 2. Update Stage Status
+    stage.status = 'PENDING'
+
+    # 3. Handle Soil Test Data (Mock Scoring Update)
+    if file_type == 'soil_test' and soil_data:
+        # Mock Soil Quality Scoring: Higher pH/nutrients give better mock score
+        soil_score_boost = 0
+        if soil_data.get('ph', 6) > 6.5:
+            soil_score_boost += 5
+        # Re-calculate score and update scorecard
+        scorecard = season.scorecards[-1] if season.scorecards else None
+        if scorecard:
+            scorecard.xai_factors = scorecard.xai_factors or []
+            # Find and update the "Soil Quality Score (Mock)" factor
+            for factor in scorecard.xai_factors:
+                if factor.get('factor') == 'Soil Quality Score (Mock)':
+                    factor['weight'] = factor.get('weight', 0) + soil_score_boost * 10
+                    break
+            new_score, new_risk, new_xai = calculate_score_and_xai(season)
+            scorecard.score = new_score
+            scorecard.risk_band = new_risk
+            scorecard.xai_factors = new_xai
+            db.session.add(scorecard)
+        transition_contract_state(season.id, f'STAGE_{stage_number}_SOIL_TEST_UPDATE', data=f'Score Boost: {soil_score_boost}', commit=False)
+
+    # 4. Update Contract State
+    transition_contract_state(season.id, f'STAGE_{stage_number}_PENDING', data=f'{file_type} uploaded{digest_note}', commit=False,
+                              evidence_sha256=sha256)
+    return upload
+
+
+def bind_policy_amounts(policy, season):
+    """Stores the sum insured and payout on a policy being bound, so claims and KPIs never re-aggregate LoanStage."""
+    policy.sum_insured = sum(st.disbursement_amount for st in season.stages)
+    policy.payout_amount = policy.sum_insured * INSURANCE_PAYOUT_RATE
+    policy.premium = sum(st.disbursement_amount for st in season.stages if st.role == STAGE_ROLE_PREMIUM and st.status == 'COMPLETED')
+    policy.bound_date = datetime.utcnow()
+
+
+def open_claim(policy):
+    policy.status = 'CLAIM_PENDING'
+    policy.claim_date = datetime.utcnow()
+
+
+def parse_iot_reading(payload):
+    """Extracts sensor values from an ingest payload and evaluates the drought/pest flags."""
+    temperature = payload.get('temperature')
+    moisture = payload.get('moisture')
+    ph = payload.get('ph')
+    # Determine drought: simple threshold
+    drought_flag = False
+    try:
+        if moisture is not None:
+            drought_flag = float(moisture) < DROUGHT_MOISTURE_THRESHOLD
+        elif temperature is not None:
+            # If moisture missing but temperature present, use temperature heuristic (less reliable)
+            drought_flag = float(temperature) > 35.0  # very simplistic
+    except Exception:
+        drought_flag = False
+    return {
+        'ph': ph,
+        'moisture': moisture,
+        'temperature': temperature,
+        'drought_detected': drought_flag,
+        'pest_detected': bool(payload.get('pest_detected')),
+    }
+
+
+def apply_iot_readings(readings):
+    """
+    Stores a batch of readings [(season_id, payload, received_at)] with one bulk IoTLog insert and runs the
+    drought and pest evaluation for every season in the batch. Does not commit.
+    """
+    if not readings:
+        return
+    rows = []
+    drought_seasons, pest_seasons = {}, set()
+    for season_id, payload, received_at in readings:
+        log_data = parse_iot_reading(payload)
+        log_data['raw'] = payload
+        log_data['timestamp'] = received_at.isoformat()
+        rows.append({'season_id': season_id, 'timestamp': received_at, 'data': log_data})
+        if log_data['drought_detected']:
+            drought_seasons.setdefault(season_id, log_data['moisture'])
+        if log_data['pest_detected']:
+            pest_seasons.add(season_id)
+    db.session.execute(insert(IoTLog), rows)
+
+    # If drought detected and a policy exists and is ACTIVE, mark claim pending
+    if drought_seasons:
+        for policy in Policy.query.filter(Policy.season_id.in_(drought_seasons), Policy.status == 'ACTIVE'):
+            open_claim(policy)
+            transition_contract_state(policy.season_id, 'INSURANCE_CLAIM_TRIGGERED', data=f'Drought detected (moisture={drought_seasons[policy.season_id]})', commit=False)
+    # Pest readings unlock the conditional pest-control stage, like the Field Officer trigger
+    if pest_seasons:
+        for pest_stage in LoanStage.query.filter(LoanStage.season_id.in_(pest_seasons), LoanStage.role == STAGE_ROLE_PEST, LoanStage.status == 'LOCKED'):
+            pest_stage.status = 'UNLOCKED'
+            transition_contract_state(pest_stage.season_id, 'PEST_EVENT_FLAGGED', data='IoT pest reading', commit=False)
+
+
+# Counters exposed by /api/iot/queue/metrics
+_iot_consumer_stats = {'batches': 0, 'readings': 0, 'rejected': 0, 'last_batch_size': 0, 'last_batch_ms': 0.0, 'errors': 0, 'dead_lettered': 0}
+
+
+def drain_iot_queue(queue, batch_size):
+    """Moves one batch from the write-behind queue into IoTLog in a single transaction. Returns the batch size."""
+    batch = queue.claim(batch_size)
+    if not batch:
+        return 0
+    started = time.perf_counter()
+    try:
+        farmer_ids = {farmer_id for _, farmer_id, _, _ in batch}
+        # Current season = latest season of each farmer; readings for archived (read-only) seasons are rejected
+        current_seasons = dict(db.session.query(Season.farmer_id, func.max(Season.id)).filter(Season.farmer_id.in_(farmer_ids)).group_by(Season.farmer_id))
+        archived = {sid for (sid,) in db.session.query(SeasonSummary.season_id).filter(SeasonSummary.season_id.in_(current_seasons.values()))}
+        current_seasons = {farmer_id: sid for farmer_id, sid in current_seasons.items() if sid not in archived}
+        readings = [
+            (current_seasons[farmer_id], payload, datetime.utcfromtimestamp(received_at))
+            for _, farmer_id, payload, received_at in batch if farmer_id in current_seasons
+        ]
+        apply_iot_readings(readings)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # After IOT_MAX_ATTEMPTS failures the batch goes to the dead-letter table so later readings are not blocked
+        _iot_consumer_stats['dead_lettered'] += queue.release([item[0] for item in batch], error=repr(e))
+        _iot_consumer_stats['errors'] += 1
+        raise
+    queue.ack([item[0] for item in batch])
+    _iot_consumer_stats['batches'] += 1
+    _iot_consumer_stats['readings'] += len(readings)
+    _iot_consumer_stats['rejected'] += len(batch) - len(readings)  # Unknown farmer, no season or archived season
+    _iot_consumer_stats['last_batch_size'] = len(batch)
+    _iot_consumer_stats['last_batch_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return len(batch)
+
+
+def run_iot_consumer(app, queue):
+    """Drains the write-behind queue in batches forever, idling IOT_FLUSH_INTERVAL whenever it runs dry."""
+    while True:
+        try:
+            with app.app_context():
+                drained = drain_iot_queue(queue, app.config['IOT_BATCH_SIZE'])
+        except Exception as e:
+            print(f"IoT consumer error: {e}", file=sys.stderr)
+            drained = 0
+        if drained < app.config['IOT_BATCH_SIZE']:
+            time.sleep(app.config['IOT_FLUSH_INTERVAL'])
+
+
+def start_iot_consumer(app, queue):
+    """Starts the background thread that drains the write-behind queue in batches."""
+    thread = threading.Thread(target=run_iot_consumer, args=(app, queue), name='iot-write-behind', daemon=True)
+    thread.start()
+    return thread
+
+
+_fps_model_cache = {'mtime': None, 'model': None}
+
+
+def get_fps_model():
+    """Returns the persisted federated FPS model (reloaded when the file changes), or None."""
+    try:
+        mtime = os.path.getmtime(FPS_MODEL_PATH)
+    except OSError:
+        return None
+    if _fps_model_cache['mtime'] != mtime:
+        _fps_model_cache['model'] = federated.load_model(FPS_MODEL_PATH)
+        _fps_model_cache['mtime'] = mtime
+    model = _fps_model_cache['model']
+    # A model trained on another feature set is ignored until `flask fl-train` runs again
+    return model if model and model.get('features') == federated.FEATURE_NAMES else None
+
+
+def season_features(season):
+    """
+    Feature vector of a season in federated.FEATURE_NAMES order. Stage progress is deliberately not a feature:
+    the training label is derived from it (see build_federated_partitions).
+    """
+    farmer = season.farmer
+    return [
+        farmer.plots[0].size,
+        farmer.age or 0,
+        1.0 if (farmer.age or 0) < 40 else 0.0,
+        1.0 if any(u.season_id == season.id and u.file_type == 'soil_test' for u in farmer.uploads) else 0.0,
+        1.0 if any(log.data and log.data.get('pest_detected') for log in season.iot_logs) else 0.0,
+        1.0 if any(log.data and log.data.get('drought_detected') for log in season.iot_logs) else 0.0,
+    ]
+
+
+def build_federated_partitions(default_clients=4):
+    """
+    Feature/label arrays per cooperative client, built with set-based queries over closed seasons.
+    Label: 1 if the season did not default at its end_date (see season_defaulted), else 0. Features match
+    season_features; archived seasons take their pest/drought flags from the summary row.
+    Farmers without a cooperative are spread over `default_clients` synthetic cooperatives.
+    """
+    stage_stats = db.session.query(
+        LoanStage.season_id,
+        func.max(LoanStage.stage_number).label('last_stage'),
+        func.max(case((LoanStage.status == 'COMPLETED', LoanStage.stage_number))).label('last_completed')
+    ).group_by(LoanStage.season_id).subquery()
+    first_plot = db.session.query(Plot.farmer_id, func.min(Plot.id).label('plot_id')).group_by(Plot.farmer_id).subquery()
+    soil = db.session.query(FileUpload.season_id).filter(FileUpload.file_type == 'soil_test').distinct().subquery()
+    iot = db.session.query(
+        IoTLog.season_id,
+        func.max(case((IoTLog.data['pest_detected'].as_boolean(), 1), else_=0)).label('pest'),
+        func.max(case((IoTLog.data['drought_detected'].as_boolean(), 1), else_=0)).label('drought')
+    ).group_by(IoTLog.season_id).subquery()
+
+    rows = db.session.query(
+        Season.farmer_id, Farmer.cooperative, Farmer.age, Plot.size,
+        stage_stats.c.last_stage, stage_stats.c.last_completed, soil.c.season_id, iot.c.pest, iot.c.drought,
+        SeasonSummary.season_id, SeasonSummary.defaulted, SeasonSummary.pest_flag, SeasonSummary.drought_flag
+    ).join(Farmer, Farmer.id == Season.farmer_id
+    ).join(first_plot, first_plot.c.farmer_id == Season.farmer_id
+    ).join(Plot, Plot.id == first_plot.c.plot_id
+    ).outerjoin(stage_stats, stage_stats.c.season_id == Season.id
+    ).outerjoin(soil, soil.c.season_id == Season.id
+    ).outerjoin(iot, iot.c.season_id == Season.id
+    ).outerjoin(SeasonSummary, SeasonSummary.season_id == Season.id
+    ).filter(Season.end_date < datetime.utcnow()).all()
+
+    clients = {}
+    for (farmer_id, cooperative, age, size, last_stage, last_completed, soil_season, pest, drought,
+         summary_season, defaulted, archived_pest, archived_drought) in rows:
+        if summary_season is not None:  # Archived season: outcome and IoT flags come from the summary row
+            label = 0.0 if defaulted else 1.0
+            pest, drought = archived_pest, archived_drought
+        elif last_stage is not None:
+            label = 1.0 if last_completed == last_stage else 0.0
+        else:
+            continue
+        age = age or 0
+        features = [size or 0.0, age, 1.0 if age < 40 else 0.0, 1.0 if soil_season else 0.0, 1.0 if pest else 0.0, 1.0 if drought else 0.0]
+        key = cooperative or f"coop-{farmer_id % default_clients}"
+        clients.setdefault(key, ([], []))
+        clients[key][0].append(features)
+        clients[key][1].append(label)
+    return {key: (np.array(X, dtype=np.float64), np.array(y, dtype=np.float64)) for key, (X, y) in clients.items()}
+
+
+# Top-level keys of the farmer status payload, selectable with ?fields=
+FARMER_STATUS_FIELDS = (
+    'farmer_id', 'name', 'phone', 'crop', 'current_status', 'stages', 'uploads', 'contract_state', 'contract_hash',
+    'contract_history', 'policy_id', 'has_insurance', 'insurance_claim_status', 'insurance_triggered',
+    'insurance_payout_amount', 'archived',
+)
+
+
+def season_score(season):
+    """Latest score of a season without loading its stages or IoT logs (see Farmer.current_status)."""
+    if season is None:
+        return 50
+    if season.is_archived:
+        return season.summary.final_score if season.summary.final_score is not None else 50
+    return season.scorecards[-1].score if season.scorecards else 50
+
+
+def parse_fields(raw, allowed):
+    """Parses a ?fields=a,b projection. Returns None (all fields) when absent; raises ValueError for unknown names."""
+    if not raw:
+        return None
+    fields = {f.strip() for f in raw.split(',') if f.strip()}
+    unknown = sorted(fields - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields
+
+
+def contract_entry(contract):
+    """API form of one contract log entry; the binary hash is hex-encoded only here."""
+    entry = {
+        'id': contract.id,
+        'timestamp': contract.timestamp.isoformat(),
+        'state': contract.state,
+        'hash': contract.hash_hex
+    }
+    if contract.evidence_sha256:
+        entry['evidence_sha256'] = contract.evidence_sha256.hex()
+    return entry
+
+
+def archived_contracts(records):
+    return sorted(records['contracts'], key=lambda c: (c.timestamp, c.id))
+
+
+def latest_contracts(season, records, n):
+    """The season's latest `n` contract entries, oldest first, read through ix_contract_season_timestamp."""
+    if season.is_archived:
+        return archived_contracts(records)[-n:]
+    rows = Contract.query.filter_by(season_id=season.id).order_by(Contract.timestamp.desc(), Contract.id.desc()).limit(n).all()
+    return rows[::-1]
+
+
+def latest_contracts_by_season(season_ids, n):
+    """Latest `n` contract entries of each season (oldest first) with a single windowed query."""
+    ranked = db.session.query(
+        Contract.id,
+        func.row_number().over(partition_by=Contract.season_id, order_by=(Contract.timestamp.desc(), Contract.id.desc())).label('rank')
+    ).filter(Contract.season_id.in_(season_ids)).subquery()
+    rows = Contract.query.join(ranked, ranked.c.id == Contract.id).filter(ranked.c.rank <= n).order_by(
+        Contract.season_id, Contract.timestamp, Contract.id).all()
+    grouped = {sid: [] for sid in season_ids}
+    for row in rows:
+        grouped[row.season_id].append(row)
+    return grouped
+
+
+ADMIN_FARMER_FIELDS = ('id', 'name', 'phone', 'stages_completed', 'score', 'stages')
+INSURER_FARMER_FIELDS = ('id', 'name', 'policy_status', 'score')
+
+
+def build_farmer_status(farmer, season, fields=None, recent_contracts=None):
+    """
+    Builds the farmer status payload. With a `fields` projection only the selected keys are computed,
+    so relationships behind unselected keys (uploads, contracts, policies, ...) are never loaded.
+    `recent_contracts` may pass the season's latest contracts when they were already fetched in bulk.
+    """
+    def want(*names):
+        return fields is None or any(name in fields for name in names)
+
+    records = season_records(season)  # Transparently reads archived seasons from disk
+    status = {}
+    if want('farmer_id'):
+        status['farmer_id'] = farmer.id
+    if want('name'):
+        status['name'] = farmer.name
+    if want('phone'):
+        status['phone'] = farmer.phone
+    if want('crop'):
+        status['crop'] = season.crop
+    if want('current_status'):
+        status['current_status'] = farmer.current_status
+    if want('stages'):
+        status['stages'] = [
+            {
+                'stage_number': s.stage_number,
+                'stage_name': s.stage_name,
+                'status': s.status,
+                'disbursement_amount': s.disbursement_amount
+            } for s in records['stages']
+        ]
+    if want('uploads'):
+        status['uploads'] = [
+            {
+                'stage_number': u.stage_number,
+                'file_type': u.file_type,
+                'file_name': u.file_name,
+                'sha256': u.sha256.hex() if u.sha256 else None,
+                'size': u.size,
+                'upload_date': u.upload_date.isoformat()
+            } for u in farmer.uploads
+        ]
+    if want('contract_state', 'contract_hash', 'contract_history'):
+        # Only the latest entries are embedded; the full history is paginated at /api/farmer/<id>/contracts
+        if recent_contracts is None:
+            recent_contracts = latest_contracts(season, records, CONTRACT_HISTORY_EMBED)
+        latest_contract = recent_contracts[-1] if recent_contracts else None
+        if want('contract_state'):
+            status['contract_state'] = latest_contract.state if latest_contract else 'N/A'
+        if want('contract_hash'):
+            status['contract_hash'] = latest_contract.hash_hex if latest_contract else 'N/A'
+        if want('contract_history'):
+            status['contract_history'] = [contract_entry(c) for c in recent_contracts]
+    if want('policy_id', 'has_insurance', 'insurance_claim_status', 'insurance_triggered', 'insurance_payout_amount'):
+        latest_policy = season.policies[-1] if season.policies else None
+        if want('policy_id'):
+            status['policy_id'] = latest_policy.policy_id if latest_policy else None
+        if want('has_insurance'):
+            status['has_insurance'] = True if latest_policy else False
+        if want('insurance_claim_status'):
+            status['insurance_claim_status'] = latest_policy.status if latest_policy else None
+        if want('insurance_triggered'):
+            status['insurance_triggered'] = True if latest_policy and (latest_policy.status and 'CLAIM' in latest_policy.status.upper()) else False
+        if want('insurance_payout_amount'):
+            # --- Individual insurance payout (stored on the policy when it was bound) ---
+            insurance_payout_amount = 0
+            if latest_policy and latest_policy.status in ['CLAIM_APPROVED', 'CLAIMED']:
+                insurance_payout_amount = latest_policy.payout_amount
+            status['insurance_payout_amount'] = insurance_payout_amount
+    if want('archived'):
+        status['archived'] = season.is_archived
+    return status
+
+
+MAX_BATCH_STATUS_IDS = 500
+
+
+def farmer_status_load_options(fields=None):
+    """Eager-load options (one IN query per relationship) covering what build_farmer_status needs for `fields`."""
+    def want(*names):
+        return fields is None or any(name in fields for name in names)
+
+    seasons = selectinload(Farmer.seasons)
+    options = [seasons.selectinload(Season.summary)]
+    if want('current_status'):
+        options += [seasons.selectinload(Season.scorecards), seasons.selectinload(Season.iot_logs)]
+    if want('current_status', 'stages'):
+        options.append(seasons.selectinload(Season.stages))
+    if want('policy_id', 'has_insurance', 'insurance_claim_status', 'insurance_triggered', 'insurance_payout_amount'):
+        options.append(seasons.selectinload(Season.policies))
+    if want('uploads'):
+        options.append(selectinload(Farmer.uploads))
+    return options
+
+
+def portfolio_snapshot():
+    """
+    Per-season arrays of the outstanding portfolio for risk simulation: disbursed exposure, total loan,
+    latest score/risk band and latest policy status, gathered with one grouped query. Outstanding means the
+    season is still running with funds out and its final stage not yet completed, or it has an open claim;
+    ended and fully disbursed seasons carry no forward-looking risk and are left out.
+    """
+    stage_totals = db.session.query(
+        LoanStage.season_id,
+        func.sum(LoanStage.disbursement_amount).label('total_loan'),
+        func.sum(case((LoanStage.status == 'COMPLETED', LoanStage.disbursement_amount), else_=0.0)).label('disbursed'),
+        func.max(LoanStage.stage_number).label('last_stage'),
+        func.max(case((LoanStage.status == 'COMPLETED', LoanStage.stage_number))).label('last_completed')
+    ).group_by(LoanStage.season_id).subquery()
+    latest_score = db.session.query(Scorecard.season_id, func.max(Scorecard.id).label('scorecard_id')).group_by(Scorecard.season_id).subquery()
+    latest_policy = db.session.query(Policy.season_id, func.max(Policy.id).label('policy_id')).group_by(Policy.season_id).subquery()
+    rows = db.session.query(
+        stage_totals.c.season_id, stage_totals.c.disbursed, stage_totals.c.total_loan,
+        Scorecard.score, Scorecard.risk_band, Policy.status
+    ).outerjoin(latest_score, latest_score.c.season_id == stage_totals.c.season_id
+    ).outerjoin(Scorecard, Scorecard.id == latest_score.c.scorecard_id
+    ).outerjoin(latest_policy, latest_policy.c.season_id == stage_totals.c.season_id
+    ).outerjoin(Policy, Policy.id == latest_policy.c.policy_id
+    ).join(Season, Season.id == stage_totals.c.season_id
+    ).filter(or_(
+        Policy.status == 'CLAIM_PENDING',
+        and_(or_(Season.end_date.is_(None), Season.end_date >= datetime.utcnow()), stage_totals.c.disbursed > 0,
+             or_(stage_totals.c.last_completed.is_(None), stage_totals.c.last_completed != stage_totals.c.last_stage))
+    )).order_by(stage_totals.c.season_id).all()
+    return {
+        'season_ids': [r[0] for r in rows],
+        'exposure': [r[1] or 0.0 for r in rows],
+        'sum_insured': [r[2] or 0.0 for r in rows],
+        'scores': [r[3] if r[3] is not None else 50 for r in rows],
+        'risk_bands': [r[4] or 'MEDIUM' for r in rows],
+        'policy_status': [r[5] for r in rows],
+    }
+
+
+# Simulation results keyed by (portfolio snapshot digest, parameters); oldest entries are evicted first
+RISK_CACHE_SIZE = 32
+_risk_cache = OrderedDict()
+# The web route simulates in-process (no pool is forked inside the threaded server), one run at a time, up to these
+# limits; larger runs go through `flask risk-sim --workers N`, which gives identical results for any N
+RISK_WEB_MAX_SCENARIOS = int(os.environ.get('GENFIN_RISK_WEB_MAX_SCENARIOS', 200_000))
+RISK_WEB_MAX_CELLS = int(os.environ.get('GENFIN_RISK_WEB_MAX_CELLS', 200_000_000))  # scenarios x seasons, a few seconds on one core
+_risk_lock = threading.Lock()
+
+
+def simulate_portfolio_risk(scenarios=100_000, seed=0, confidence=0.99, workers=1, max_cells=None):
+    """
+    Runs the Monte Carlo loss simulation for the current portfolio, reusing cached results for an unchanged snapshot.
+    Raises ValueError when a new run would exceed `max_cells` scenario x season draws.
+    """
+    snapshot = portfolio_snapshot()
+    digest = hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:16]
+    key = (digest, scenarios, seed, confidence)
+    with _risk_lock:  # Concurrent cache misses wait for the running simulation instead of competing for the CPU
+        if key in _risk_cache:
+            _risk_cache.move_to_end(key)
+            return dict(_risk_cache[key], snapshot=digest, cached=True)
+        seasons = len(snapshot['season_ids'])
+        if max_cells is not None and scenarios * seasons > max_cells:
+            raise ValueError(f'{scenarios:,} scenarios x {seasons:,} outstanding seasons exceeds the limit of {max_cells:,} draws per request; '
+                             f'lower scenarios (at most {max(1, max_cells // max(1, seasons)):,}) or run `flask risk-sim`.')
+        result = portfolio_risk.simulate_portfolio(
+            snapshot['scores'], snapshot['risk_bands'], snapshot['exposure'], snapshot['sum_insured'], snapshot['policy_status'],
+            scenarios=scenarios, seed=seed, confidence=confidence, workers=workers
+        )
+        _risk_cache[key] = result
+        if len(_risk_cache) > RISK_CACHE_SIZE:
+            _risk_cache.popitem(last=False)
+    return dict(result, snapshot=digest, cached=False)
 
 
 def calculate_score_and_xai(season):
-    """Mocks the AI scoring engine and XAI explanation."""
+    """AI scoring engine and XAI explanation: the federated FPS model when trained, otherwise the mock formula."""
     if not season.farmer.plots:
         return 50, 'MEDIUM', []
-    plot_size = season.farmer.plots[0].size
+    model = get_fps_model()
+    if model:
+        probability, contributions = federated.predict(model, season_features(season))
+        score = round(probability * 100, 1)
+        risk_band = 'LOW' if score >= 75 else ('MEDIUM' if score >= 50 else 'HIGH')
+        # XAI: each feature's contribution to the model logit, scaled for display
+        display_xai = [{"factor": "Model Baseline", "weight": round(model['intercept'] * 10, 2)}]
+        display_xai += [{"factor": name, "weight": round(c * 10, 2)} for name, c in zip(model['features'], contributions)]
+        return score, risk_band, display_xai
     stage_count = len(season.stages)
     completed_stages = sum(1 for s in season.stages if s.status == 'COMPLETED')
+    return mock_score_and_xai(season.farmer.plots[0].size, season.farmer.age, completed_stages, stage_count)
+
+
+def mock_score_and_xai(plot_size, age, completed_stages, stage_count):
+    """The mock FPS formula, on plain values so bulk jobs can score without loading a season."""
     # Mock XAI Factors (Federated Learning Mock)
     xai_factors = [
         {"factor": "KYC Completion (Base)", "weight": 50},
         {"factor": "Land Size (Acres)", "weight": plot_size * 2},
         {"factor": "Stages Completed Ratio", "weight": (completed_stages / max(1, stage_count)) * 450},
         {"factor": "Soil Quality Score (Mock)", "weight": 10},
-        {"factor": "Age (Younger +)", "weight": 5 if season.farmer.age < 40 else -5},
+        {"factor": "Age (Younger +)", "weight": 5 if age < 40 else -5},
     ]
     base_score = 35
     total_boost = sum(f['weight'] for f in xai_factors)
@@ -243,6 +1260,524 @@ def calculate_score_and_xai(season):
     return round(score, 1), risk_band, display_xai
 
 
+# --- SYNTHETIC PORTFOLIO GENERATOR (flask seed) ---
+SEED_CHUNK_SIZE = 5000
+SEED_CROPS = ['maize', 'beans', 'sorghum', 'cassava', 'groundnuts', 'sunflower', 'potatoes']
+SEED_FIRST_NAMES = ['Amina', 'Thabo', 'Wanjiru', 'Kwame', 'Chipo', 'Sipho', 'Fatuma', 'Kofi', 'Nomsa', 'Baraka',
+                    'Zanele', 'Juma', 'Ayodele', 'Lindiwe', 'Tendai', 'Mwajuma', 'Ousmane', 'Precious', 'Musa', 'Esi']
+SEED_LAST_NAMES = ['Mwangi', 'Dlamini', 'Okafor', 'Banda', 'Mensah', 'Nkosi', 'Otieno', 'Phiri', 'Kamau', 'Moyo',
+                   'Ndlovu', 'Achieng', 'Mutua', 'Zulu', 'Osei', 'Chirwa', 'Kiprop', 'Sithole', 'Nyirenda', 'Adeyemi']
+# (region, lat_min, lat_max, lon_min, lon_max) used for plot geo tags and cooperative names
+SEED_REGIONS = [
+    ('Nakuru', -0.9, 0.2, 35.5, 36.6), ('Eldoret', 0.2, 0.9, 34.9, 35.6), ('Mbeya', -9.3, -8.5, 32.9, 33.9),
+    ('Lilongwe', -14.3, -13.5, 33.3, 34.1), ('Chipata', -13.9, -13.3, 32.2, 32.9), ('Limpopo', -24.5, -22.5, 28.5, 31.0),
+]
+SEED_POLICY_STATUSES = [('ACTIVE', 0.55), ('CLAIM_PENDING', 0.15), ('CLAIM_APPROVED', 0.20), ('CLAIM_REJECTED', 0.10)]
+SEED_PEST_RATE = 0.3
+
+
+def contract_hash(previous_hash, season_id, state, data, when):
+    """
+    Raw SHA-256 digest of one contract transition, chained to the previous entry's digest (same format as
+    transition_contract_state). The chained input uses the hex form so chains stay verifiable from API output.
+    """
+    if previous_hash is None:
+        return hashlib.sha256(f"{season_id}_{state}_{data or ''}_{when}".encode()).digest()
+    return hashlib.sha256(f"{previous_hash.hex()}_{state}_{data or ''}_{when}".encode()).digest()
+
+
+def _seed_season(rng, farmer_id, season_id, plot_size, age, start, as_of, iot_readings, template):
+    """Generates one season's stages, contract chain, scorecard, policy and IoT readings as insert rows."""
+    total_loan = plot_size * LOAN_PER_ACRE
+    elapsed = min(as_of, start + timedelta(days=180)) - start
+    target = max(0, min(len(template), int(elapsed / timedelta(days=180) * len(template) + rng.uniform(-1.5, 1.5))))
+    pest = any(role == STAGE_ROLE_PEST for *_, role in template) and rng.random() < SEED_PEST_RATE
+
+    stages, events, completed = [], [('DRAFT', 'Initial Registration'), ('ACTIVE', 'Contract Signed')], 0
+    current_stage = None
+    premium_state = None
+    for number, name, share, initial_status, role in template:
+        amount = share * total_loan
+        if current_stage is not None:
+            status = 'LOCKED'
+        elif role == STAGE_ROLE_PEST and not pest:
+            status = 'LOCKED'  # Conditional stage skipped when no pest event was logged
+            # Logged just before the previous stage's completion, like the disbursement route does
+            events.insert(len(events) - 1 if events[-1][0].endswith('_COMPLETED') else len(events), (f'STAGE_{number}_SKIPPED', 'No Pest Event Triggered'))
+        elif completed < target:
+            if role == STAGE_ROLE_PEST:
+                events.append(('PEST_EVENT_FLAGGED', 'Field Officer Mock Trigger'))
+            events += [(f'STAGE_{number}_PENDING', 'photo_evidence uploaded'), (f'STAGE_{number}_APPROVED', 'Field Officer Approval')]
+            if role == STAGE_ROLE_PREMIUM:
+                events.append(('POLICY_ACTIVE', f'Policy POL-{farmer_id}-{start.year} Bound after Premium Disbursement'))
+            events.append((f'STAGE_{number}_COMPLETED', f'Disbursed ${amount}'))
+            status = 'COMPLETED'
+            completed += 1
+        else:
+            status = rng.choice(['UNLOCKED', 'PENDING', 'APPROVED'])
+            if status in ('PENDING', 'APPROVED'):
+                events.append((f'STAGE_{number}_PENDING', 'photo_evidence uploaded'))
+            if status == 'APPROVED':
+                events.append((f'STAGE_{number}_APPROVED', 'Field Officer Approval'))
+            current_stage = number
+        if role == STAGE_ROLE_PREMIUM:
+            premium_state = status
+        stages.append({'season_id': season_id, 'stage_number': number, 'stage_name': name, 'status': status, 'role': role,
+                       'disbursement_amount': amount, 'completed_date': None, 'version': 1})
+
+    # Policies are bound when the premium stage is disbursed, as in the disbursement route
+    policy = None
+    if premium_state == 'COMPLETED':
+        draw, policy_status = rng.random(), SEED_POLICY_STATUSES[-1][0]
+        for candidate, weight in SEED_POLICY_STATUSES:
+            if draw < weight:
+                policy_status = candidate
+                break
+            draw -= weight
+        if policy_status != 'ACTIVE':
+            events.append(('INSURANCE_CLAIM_TRIGGERED', 'Drought detected (moisture=12.0)'))
+        if policy_status == 'CLAIM_APPROVED':
+            events.append(('INSURANCE_CLAIM_APPROVED', 'Claim approved by insurer'))
+        elif policy_status == 'CLAIM_REJECTED':
+            events.append(('INSURANCE_CLAIM_REJECTED', 'Claim rejected by insurer'))
+        policy = {'season_id': season_id, 'policy_id': f'POL-{farmer_id}-{start.year}', 'triggers': json.dumps({"rainfall": "<10mm"}),
+                  'status': policy_status, 'version': 1, 'sum_insured': total_loan, 'payout_amount': total_loan * INSURANCE_PAYOUT_RATE,
+                  'premium': sum(st['disbursement_amount'] for st in stages if st['role'] == STAGE_ROLE_PREMIUM and st['status'] == 'COMPLETED'),
+                  'bound_date': None, 'claim_date': None}
+
+    # Spread the contract events over the elapsed part of the season and chain their hashes
+    step = elapsed / (len(events) + 1)
+    contracts, previous_hash = [], None
+    for i, (state, data) in enumerate(events):
+        when = start + step * (i + 1)
+        previous_hash = contract_hash(previous_hash, season_id, state, data, when)
+        contracts.append({'season_id': season_id, 'state': state, 'hash_value': previous_hash, 'timestamp': when})
+        if state.endswith('_COMPLETED') and state.startswith('STAGE_'):
+            number = int(state.split('_')[1])
+            next(st for st in stages if st['stage_number'] == number)['completed_date'] = when
+        elif state == 'POLICY_ACTIVE' and policy:
+            policy['bound_date'] = when
+        elif state == 'INSURANCE_CLAIM_TRIGGERED' and policy:
+            policy['claim_date'] = when
+
+    score, risk_band, xai = mock_score_and_xai(plot_size, age, completed, len(template))
+    scorecard = {'season_id': season_id, 'score': score, 'risk_band': risk_band, 'xai_factors': xai, 'timestamp': start}
+
+    # Weekly sensor readings over the elapsed part of the season (at most iot_readings), plus trigger readings
+    readings = []
+    weeks = min(iot_readings, int(elapsed / timedelta(days=7)))
+    special = []
+    if policy and policy['claim_date']:
+        special.append((policy['claim_date'], 12.0, False))
+    if pest:
+        special.append((start + elapsed / 2, None, True))
+    for i in range(weeks):
+        special.append((start + timedelta(days=7 * (i + 1)), round(rng.gauss(42, 10), 1), False))
+    for when, moisture, pest_detected in sorted(special, key=lambda r: r[0]):
+        payload = {'moisture': moisture, 'temperature': round(rng.gauss(27, 4), 1), 'ph': round(rng.gauss(6.5, 0.5), 2)}
+        if pest_detected:
+            payload = {'pest_detected': True}
+        log_data = parse_iot_reading(payload)
+        log_data['raw'] = payload
+        log_data['timestamp'] = when.isoformat()
+        readings.append({'season_id': season_id, 'timestamp': when, 'data': log_data})
+    return stages, contracts, scorecard, policy, readings
+
+
+SEED_TABLES = (Farmer, Plot, Season, LoanStage, Contract, Scorecard, Policy, IoTLog)
+
+
+def _seed_chunk(args):
+    """
+    Generates the rows for farmers [chunk_start, chunk_stop) as {table name: list of row dicts}.
+    Pure function of its arguments: each farmer's RNG is derived from the seed and the farmer's offset, so
+    chunks can be generated in any process and in any order, and the output does not depend on the chunk size.
+    """
+    seed, chunk_start, chunk_stop, first_farmer_id, first_season_id, as_of, iot_readings, templates = args
+    rows = {model.__tablename__: [] for model in SEED_TABLES}
+    for offset in range(chunk_start, chunk_stop):
+        rng = random.Random(f'{seed}:{offset}')
+        farmer_id, season_id = first_farmer_id + offset, first_season_id + offset
+        region, lat_min, lat_max, lon_min, lon_max = rng.choice(SEED_REGIONS)
+        age = rng.randint(18, 70)
+        plot_size = round(min(25.0, rng.lognormvariate(0.8, 0.7)), 1) or 0.5
+        crop = rng.choice(SEED_CROPS)
+        start = as_of - timedelta(days=rng.randint(0, 360), minutes=rng.randint(0, 1439))
+        rows['farmer'].append({
+            'id': farmer_id, 'name': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+            'phone': f'+2547{farmer_id:08d}', 'id_document': f'{rng.randrange(10 ** 12, 10 ** 13)}',
+            'gender': rng.choice(['Female', 'Male']), 'age': age, 'next_of_kin': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+            'registration_date': start, 'erased_date': None, 'cooperative': f'{region} Coop {rng.randint(1, 5)}'
+        })
+        rows['plot'].append({'farmer_id': farmer_id, 'size': plot_size,
+                             'geo_tag': f'{rng.uniform(lat_min, lat_max):.5f},{rng.uniform(lon_min, lon_max):.5f}'})
+        version, template = templates[crop]
+        stages, contracts, scorecard, policy, readings = _seed_season(
+            rng, farmer_id, season_id, plot_size, age, start, as_of, iot_readings, template)
+        rows['season'].append({'id': season_id, 'farmer_id': farmer_id, 'crop': crop, 'start_date': start,
+                               'end_date': start + timedelta(days=180), 'stage_template_version': version})
+        rows['loan_stage'] += stages
+        rows['contract'] += contracts
+        rows['scorecard'].append(scorecard)
+        if policy:
+            rows['policy'].append(policy)
+        rows['io_t_log'] += readings
+    return rows
+
+
+def _sqlite_rows(table, rows):
+    """Renders row dicts as DB-API tuples in the formats SQLAlchemy uses for SQLite (ISO datetimes, JSON text)."""
+    columns = list(rows[0])
+    converters = []
+    for name in columns:
+        column_type = table.c[name].type
+        if isinstance(column_type, db.JSON):
+            converters.append(json.dumps)
+        elif isinstance(column_type, db.DateTime):
+            converters.append(lambda v: v.strftime('%Y-%m-%d %H:%M:%S.%f') if v is not None else None)
+        else:
+            converters.append(None)
+    sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    values = [tuple(conv(row[name]) if conv else row[name] for name, conv in zip(columns, converters)) for row in rows]
+    return sql, values
+
+
+def seed_portfolio(n_farmers, seed=0, as_of=None, chunk_size=SEED_CHUNK_SIZE, iot_readings=12, workers=None):
+    """
+    Bulk-loads a synthetic portfolio. Chunks of farmers are generated in a process pool while the main process
+    inserts finished chunks in order, one transaction per chunk. The same seed and as-of date always produce
+    identical rows. On SQLite rows go through a raw executemany, secondary indexes are rebuilt after the load
+    and the journal/sync PRAGMAs are relaxed while it runs.
+    """
+    as_of = as_of or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    workers = workers or os.cpu_count() or 1
+    templates = {crop: get_stage_template(crop) for crop in SEED_CROPS}
+    engine = db.engine
+    sqlite = engine.dialect.name == 'sqlite'
+    indexes = [index for model in SEED_TABLES for index in model.__table__.indexes]
+    first_farmer_id = (db.session.query(func.max(Farmer.id)).scalar() or 0) + 1
+    first_season_id = (db.session.query(func.max(Season.id)).scalar() or 0) + 1
+    db.session.commit()
+    jobs = [
+        (seed, chunk_start, min(n_farmers, chunk_start + chunk_size), first_farmer_id, first_season_id, as_of, iot_readings, templates)
+        for chunk_start in range(0, n_farmers, chunk_size)
+    ]
+
+    def generated_chunks():
+        if workers == 1:
+            yield from map(_seed_chunk, jobs)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for job in jobs:
+                pending.append(pool.submit(_seed_chunk, job))
+                if len(pending) >= 2 * workers:  # Bound the chunks waiting in memory for the writer
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    with engine.connect() as conn:
+        if sqlite:
+            for pragma in ('journal_mode=MEMORY', 'synchronous=OFF', 'cache_size=-262144', 'temp_store=MEMORY'):
+                conn.exec_driver_sql(f'PRAGMA {pragma}')
+            conn.commit()
+        with conn.begin():
+            for index in indexes:
+                index.drop(conn, checkfirst=True)
+        try:
+            for job, rows in zip(jobs, generated_chunks()):
+                with conn.begin():
+                    for model in SEED_TABLES:
+                        table_rows = rows[model.__tablename__]
+                        if not table_rows:
+                            continue
+                        if sqlite:
+                            conn.exec_driver_sql(*_sqlite_rows(model.__table__, table_rows))
+                        else:
+                            conn.execute(model.__table__.insert(), table_rows)
+                print(f"  seeded {job[3]}/{n_farmers} farmers", file=sys.stderr)
+        finally:
+            with conn.begin():
+                for index in indexes:
+                    index.create(conn, checkfirst=True)
+            if sqlite:
+                conn.exec_driver_sql('PRAGMA synchronous=FULL')
+                conn.exec_driver_sql('PRAGMA journal_mode=DELETE')
+                conn.exec_driver_sql('ANALYZE')
+                conn.commit()
+    return as_of
+
+
+# Per-process engines used by replay jobs; pool workers start with none and open their own connections
+_replay_engines = {}
+
+
+def _reset_replay_engines():
+    _replay_engines.clear()
+
+
+def _stage_template_layouts(conn):
+    """{(crop, version): ({stage_number: initial_status}, pest-control stage number or None)} for every stored template."""
+    templates = {}
+    for crop, version, number, status, role in conn.execute(select(
+            StageTemplate.crop, StageTemplate.version, StageTemplate.stage_number, StageTemplate.initial_status, StageTemplate.role)):
+        statuses, pest_stage = templates.setdefault((crop, version), ({}, None))
+        statuses[number] = status
+        if role == STAGE_ROLE_PEST:
+            templates[(crop, version)] = (statuses, number)
+    return templates
+
+
+def _replay_season_range(args):
+    """
+    Replays the contract log of the hot seasons with ids in [first_id, last_id] and diffs the result against
+    their live LoanStage/Policy rows. Resumes each season from its snapshot when the snapshot's last entry is
+    still in the log unchanged. Returns counts, diffs and the snapshots due for a refresh.
+    """
+    uri, first_id, last_id, full, snapshot_interval, tolerance = args
+    engine = _replay_engines.get(uri)
+    if engine is None:
+        engine = _replay_engines[uri] = create_engine(uri)
+    contract, snapshot = Contract.__table__, SeasonSnapshot.__table__
+    with engine.connect() as conn:
+        templates = _stage_template_layouts(conn)
+        seasons = conn.execute(
+            select(Season.id, Season.crop, Season.stage_template_version).outerjoin(SeasonSummary)
+            .where(Season.id.between(first_id, last_id), SeasonSummary.season_id.is_(None)).order_by(Season.id)
+        ).all()
+        snapshots = {}
+        if not full:
+            # Usable snapshots: same fold rules and the entry they end at still carries the same hash
+            rows = conn.execute(
+                select(snapshot).join(contract, and_(contract.c.id == snapshot.c.last_contract_id, contract.c.season_id == snapshot.c.season_id,
+                                                     contract.c.hash_value == snapshot.c.head_hash))
+                .where(snapshot.c.season_id.between(first_id, last_id), snapshot.c.engine_version == replay.ENGINE_VERSION)
+            ).mappings()
+            snapshots = {row['season_id']: row for row in rows}
+
+        after_snapshot = or_(
+            snapshot.c.season_id.is_(None), contract.c.timestamp > snapshot.c.last_timestamp,
+            and_(contract.c.timestamp == snapshot.c.last_timestamp, contract.c.id > snapshot.c.last_contract_id)
+        )
+        events = {}
+        for season_id, contract_id, state, timestamp, hash_value in conn.execute(
+            select(contract.c.season_id, contract.c.id, contract.c.state, contract.c.timestamp, contract.c.hash_value)
+            .select_from(contract.outerjoin(snapshot, and_(snapshot.c.season_id == contract.c.season_id, snapshot.c.season_id.in_(list(snapshots)))))
+            .where(contract.c.season_id.between(first_id, last_id), after_snapshot)
+            .order_by(contract.c.season_id, contract.c.timestamp, contract.c.id)
+        ):
+            events.setdefault(season_id, []).append((contract_id, state, timestamp, hash_value))
+
+        live_stages = {}
+        for season_id, number, status, completed_date in conn.execute(
+            select(LoanStage.season_id, LoanStage.stage_number, LoanStage.status, LoanStage.completed_date)
+            .where(LoanStage.season_id.between(first_id, last_id))
+        ):
+            live_stages.setdefault(season_id, {})[number] = (status, completed_date)
+        live_policies = {}
+        for season_id, status, bound_date, claim_date in conn.execute(
+            select(Policy.season_id, Policy.status, Policy.bound_date, Policy.claim_date)
+            .where(Policy.season_id.between(first_id, last_id)).order_by(Policy.id)
+        ):
+            live_policies.setdefault(season_id, (status, bound_date, claim_date))  # Routes act on the first policy
+
+    result = {'seasons': len(seasons), 'events': 0, 'from_snapshot': 0, 'diffs': [], 'snapshots': []}
+    for season_id, crop, version in seasons:
+        base = snapshots.get(season_id)
+        if base is not None:
+            state, folded = base['state'], base['events']
+            result['from_snapshot'] += 1
+        else:
+            layout = templates.get(((crop or DEFAULT_TEMPLATE_CROP).lower(), version)) or templates.get((DEFAULT_TEMPLATE_CROP, version))
+            if layout is None:
+                layout = ({number: status for number, _, _, status, _ in DEFAULT_STAGE_TEMPLATE},
+                          next(number for number, *_, role in DEFAULT_STAGE_TEMPLATE if role == STAGE_ROLE_PEST))
+            state, folded = replay.initial_state(*layout), 0
+        season_events = events.get(season_id, [])
+        replay.fold(state, ((name, timestamp.isoformat()) for _, name, timestamp, _ in season_events))
+        result['events'] += len(season_events)
+
+        for table, key, field, replayed, live in replay.diff(state, live_stages.get(season_id, {}), live_policies.get(season_id), tolerance):
+            result['diffs'].append({'season_id': season_id, 'table': table, 'stage_number': key, 'field': field, 'replayed': replayed, 'live': live})
+        if len(season_events) >= snapshot_interval:
+            last_contract_id, _, last_timestamp, head_hash = season_events[-1]
+            result['snapshots'].append({
+                'season_id': season_id, 'last_contract_id': last_contract_id, 'last_timestamp': last_timestamp, 'head_hash': head_hash,
+                'events': folded + len(season_events), 'engine_version': replay.ENGINE_VERSION, 'state': state
+            })
+    return result
+
+
+def rebuild_state(workers=None, full=False, snapshot_interval=REPLAY_SNAPSHOT_INTERVAL, batch_seasons=REPLAY_BATCH_SEASONS,
+                  tolerance=REPLAY_TIME_TOLERANCE, write_snapshots=True):
+    """
+    Replays the whole contract ledger (hot seasons) in parallel id-range jobs and diffs the folded state against
+    the live LoanStage/Policy tables. Seasons resume from their snapshot unless `full` is set; seasons that
+    folded at least `snapshot_interval` new entries get a fresh snapshot. Live tables are never modified here.
+    """
+    started = time.perf_counter()
+    uri = db.engine.url.render_as_string(hide_password=False)
+    bounds = db.session.query(func.min(Season.id), func.max(Season.id)).one()
+    db.session.commit()
+    jobs = []
+    if bounds[0] is not None:
+        jobs = [(uri, lo, min(lo + batch_seasons - 1, bounds[1]), full, snapshot_interval, tolerance)
+                for lo in range(bounds[0], bounds[1] + 1, batch_seasons)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_reset_replay_engines) as pool:
+            results = list(pool.map(_replay_season_range, jobs))
+    else:
+        _replay_engines[uri] = db.engine
+        results = [_replay_season_range(job) for job in jobs]
+
+    report = {'seasons': 0, 'events': 0, 'from_snapshot': 0, 'snapshots_written': 0, 'diffs': []}
+    snapshots = []
+    for result in results:
+        for key in ('seasons', 'events', 'from_snapshot'):
+            report[key] += result[key]
+        report['diffs'] += result['diffs']
+        snapshots += result['snapshots']
+    if write_snapshots and snapshots:
+        for start in range(0, len(snapshots), 500):
+            chunk = snapshots[start:start + 500]
+            db.session.execute(delete(SeasonSnapshot).where(SeasonSnapshot.season_id.in_([row['season_id'] for row in chunk])))
+            db.session.execute(insert(SeasonSnapshot), chunk)
+        db.session.commit()
+        report['snapshots_written'] = len(snapshots)
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def apply_replayed_state(diffs):
+    """
+    Writes replayed stage/policy field values over diverging live rows (bumping their version, so in-flight
+    requests holding the old row get a 409). Row-level differences (missing or extra rows) are only reported.
+    Returns (fields updated, row differences skipped).
+    """
+    updated = skipped = 0
+    for d in diffs:
+        if d['field'] == 'row':
+            skipped += 1
+            continue
+        value = d['replayed']
+        if d['field'] != 'status' and value is not None:
+            value = datetime.fromisoformat(value)
+        if d['table'] == 'loan_stage':
+            statement = update(LoanStage).where(LoanStage.season_id == d['season_id'], LoanStage.stage_number == d['stage_number']
+                                                ).values({d['field']: value, 'version': LoanStage.version + 1})
+        else:
+            first_policy = select(func.min(Policy.id)).where(Policy.season_id == d['season_id']).scalar_subquery()
+            statement = update(Policy).where(Policy.id == first_policy).values({d['field']: value, 'version': Policy.version + 1})
+        db.session.execute(statement.execution_options(synchronize_session=False))
+        updated += 1
+    db.session.commit()
+    return updated, skipped
+
+
+IDEMPOTENCY_TTL = 24 * 3600  # Seconds a stored result is replayed for a repeated Idempotency-Key
+
+
+def _stored_idempotent_response(record, request_hash):
+    """Response for a key that another attempt already holds: its stored result, or 409/422."""
+    if record.request_hash != request_hash:
+        return jsonify({'message': 'This Idempotency-Key was already used with a different request body.'}), 422
+    if record.status_code is None:
+        return jsonify({'message': 'A request with this Idempotency-Key is still in progress.'}), 409
+    response = make_response(record.response_body, record.status_code, {'Content-Type': record.content_type})
+    response.headers['Idempotent-Replay'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Replays the stored response when a mutation is retried with the same Idempotency-Key header, so a client
+    retry can never produce a second disbursement or contract entry. Requests without the header run normally.
+    The key's IdempotencyRecord is added to the session before the view runs and is committed together with the
+    view's writes; a concurrent or repeated attempt fails on the unique constraint and its writes roll back.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get('Idempotency-Key')
+        if not header:
+            return view(*args, **kwargs)
+        if len(header) > 255:
+            return jsonify({'message': 'Idempotency-Key must be at most 255 characters.'}), 400
+        request_hash = hashlib.sha256(request.get_data()).digest()
+        scope = IdempotencyRecord.query.filter_by(idempotency_key=header, method=request.method, path=request.path)
+
+        def existing():
+            record = scope.first()
+            if record and record.created_date < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL):
+                db.session.delete(record)  # Expired: the key may be used again
+                db.session.commit()
+                return None
+            return record
+
+        record = existing()
+        if record is not None:
+            return _stored_idempotent_response(record, request_hash)
+        record = IdempotencyRecord(idempotency_key=header, method=request.method, path=request.path, request_hash=request_hash)
+        db.session.add(record)
+        commits = []
+        session = db.session()
+        on_commit = lambda _: commits.append(True)
+        event.listen(session, 'after_commit', on_commit)
+        try:
+            response = make_response(view(*args, **kwargs))
+        except IntegrityError:
+            db.session.rollback()
+            winner = existing()
+            if winner is None:
+                raise
+            return _stored_idempotent_response(winner, request_hash)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            event.remove(session, 'after_commit', on_commit)
+        # The record went out with the view's first commit unless the view rolled it back beforehand
+        written = bool(commits) and sa_inspect(record).persistent
+        if not written:
+            if response.status_code >= 500 or response.status_code == 409:
+                # Nothing was written under this key: leave it free so the client can retry
+                db.session.rollback()
+                winner = existing()
+                return _stored_idempotent_response(winner, request_hash) if winner else response
+            if record not in db.session:
+                db.session.add(record)
+        # Store the final response; once the view committed, even an error is final (a retry must not write again)
+        record.status_code = response.status_code
+        record.response_body = response.get_data()
+        record.content_type = response.content_type
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return _stored_idempotent_response(existing(), request_hash)
+        return response
+    return wrapper
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson. Datetimes are serialized natively as ISO 8601 strings; keys are
+    sorted like DefaultJSONProvider (sort_keys=True) so responses keep the same key order with either encoder.
+    """
+    option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of the default implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.option), mimetype=self.mimetype)
+
+
 # --- FLASK APP AND ROUTES ---
 def create_app(test_config=None):
     app = Flask(__name__)
@@ -251,14 +1786,42 @@ def create_app(test_config=None):
     app.config['SQLALCHEMY_DATABASE_URI'] = SQLITE_URI
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = 'dev_secret_key'
+    app.config['IOT_WRITE_BEHIND'] = IOT_WRITE_BEHIND
+    app.config['IOT_CONSUMER'] = IOT_CONSUMER
+    app.config['IOT_QUEUE_PATH'] = IOT_QUEUE_PATH
+    app.config['IOT_BATCH_SIZE'] = IOT_BATCH_SIZE
+    app.config['IOT_FLUSH_INTERVAL'] = IOT_FLUSH_INTERVAL
+    app.config['IOT_QUEUE_MAX_DEPTH'] = IOT_QUEUE_MAX_DEPTH
+    app.config['IOT_MAX_ATTEMPTS'] = IOT_MAX_ATTEMPTS
+    app.config['JSON_ENCODER'] = JSON_ENCODER
+    app.config['EVIDENCE_DIR'] = EVIDENCE_DIR
+    if test_config:
+        app.config.update(test_config)
+    if app.config['JSON_ENCODER'] == 'orjson' and orjson is not None:
+        app.json = OrjsonProvider(app)
 
     # Initialize Extensions
     db.init_app(app)
+
+    app.extensions['evidence_store'] = evidence = EvidenceStore(app.config['EVIDENCE_DIR'])
+
+    iot_queue = None
+    if app.config['IOT_WRITE_BEHIND']:
+        iot_queue = IoTWriteBehindQueue(app.config['IOT_QUEUE_PATH'], max_attempts=app.config['IOT_MAX_ATTEMPTS'])
+        if app.config['IOT_CONSUMER']:
+            start_iot_consumer(app, iot_queue)
     # Set CORS to allow frontend access
     CORS(app, resources={r"/api/*": {"origins": VERCEL_ORIGIN if VERCEL_ORIGIN != "*" else "*"}})
 
+    @app.errorhandler(StaleDataError)
+    def handle_concurrent_update(error):
+        # Another worker changed the LoanStage/Policy row after we read it; nothing of this request was written
+        db.session.rollback()
+        return jsonify({'message': 'The record was modified by another request. Reload and try again.'}), 409
+
     # --- API ENDPOINTS ---
     @app.route('/api/farmer/register', methods=['POST'])
+    @idempotent
     def register_farmer():
         data = request.get_json()
         try:
@@ -269,7 +1832,8 @@ def create_app(test_config=None):
                 id_document=data.get('id_document', 'N/A'),
                 gender=data.get('gender', 'N/A'),
                 age=int(data.get('age', 30)),
-                next_of_kin='N/A'  # Mocked for simplicity
+                next_of_kin='N/A',  # Mocked for simplicity
+                cooperative=data.get('cooperative')
             )
             db.session.add(farmer)
             db.session.flush()  # Get farmer ID before commit
@@ -284,12 +1848,12 @@ def create_app(test_config=None):
             db.session.flush()  # Get season ID
 
             # 4. Create Loan Stages
-            initial_stages = LoanStage.get_initial_stages(season.id)
+            initial_stages = LoanStage.get_initial_stages(season, plot.size)
             db.session.add_all(initial_stages)
 
             # 5. Create Contract (DRAFT -> ACTIVE)
-            transition_contract_state(season.id, 'DRAFT', data='Initial Registration')
-            transition_contract_state(season.id, 'ACTIVE', data='Contract Signed')
+            transition_contract_state(season.id, 'DRAFT', data='Initial Registration', commit=False)
+            transition_contract_state(season.id, 'ACTIVE', data='Contract Signed', commit=False)
 
             # 6. Create Scorecard
             score, risk_band, xai = calculate_score_and_xai(season)
@@ -312,82 +1876,137 @@ def create_app(test_config=None):
         if not season:
             return jsonify({'message': 'No active season found for farmer'}), 404
 
-        latest_contract = season.contracts[-1] if season.contracts else None
-        latest_policy = season.policies[-1] if season.policies else None
-
-        # --- MODIFICATION: Calculate individual insurance payout ---
-        insurance_payout_amount = 0
-        if latest_policy and latest_policy.status in ['CLAIM_APPROVED', 'CLAIMED']:
-            total_potential_loan = db.session.query(func.sum(LoanStage.disbursement_amount)).filter(LoanStage.season_id == season.id).scalar() or 0.0
-            insurance_payout_amount = total_potential_loan * 0.10 # Same logic as KPI endpoint
-
-        # Build response
-        status_data = {
-            'farmer_id': farmer.id,
-            'name': farmer.name,
-            'phone': farmer.phone,
-            'crop': season.crop,
-            'current_status': farmer.current_status,
-            'stages': [
-                {
-                    'stage_number': s.stage_number,
-                    'stage_name': s.stage_name,
-                    'status': s.status,
-                    'disbursement_amount': s.disbursement_amount
-                } for s in season.stages
-            ],
-            'uploads': [
-                {
-                    'stage_number': u.stage_number,
-                    'file_type': u.file_type,
-                    'file_name': u.file_name,
-                    'upload_date': u.upload_date.isoformat()
-                } for u in farmer.uploads
-            ],
-            'contract_state': latest_contract.state if latest_contract else 'N/A',
-            'contract_hash': latest_contract.hash_value if latest_contract else 'N/A',
-            'contract_history': [
-                {
-                    'timestamp': c.timestamp.isoformat(),
-                    'state': c.state,
-                    'hash': c.hash_value
-                } for c in sorted(season.contracts, key=lambda c: c.timestamp)
-            ] if season.contracts else [],
-            'policy_id': latest_policy.policy_id if latest_policy else None,
-            'has_insurance': True if latest_policy else False,
-            'insurance_claim_status': latest_policy.status if latest_policy else None,
-            'insurance_triggered': True if latest_policy and (latest_policy.status and 'CLAIM' in latest_policy.status.upper()) else False,
-            'insurance_payout_amount': insurance_payout_amount # Add new key to response
-        }
+        try:
+            fields = parse_fields(request.args.get('fields'), FARMER_STATUS_FIELDS)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        status_data = build_farmer_status(farmer, season, fields)
         return jsonify(status_data)
 
+    @app.route('/api/farmer/<int:farmer_id>/contracts', methods=['GET'])
+    def get_farmer_contracts(farmer_id):
+        """
+        Contract history of the farmer's current season (or ?season_id=), newest first, served from
+        ix_contract_season_timestamp. Pass the returned next_cursor as ?before= to get the next (older) page.
+        """
+        farmer = Farmer.query.get(farmer_id)
+        if not farmer:
+            return jsonify({'message': 'Farmer not found'}), 404
+        try:
+            limit = min(max(int(request.args.get('limit', CONTRACT_PAGE_SIZE)), 1), 500)
+            season_id = request.args.get('season_id', type=int)
+            before = request.args.get('before')
+            if before:
+                before_date, before_id = before.rsplit('_', 1)
+                before_date, before_id = datetime.fromisoformat(before_date), int(before_id)
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or cursor.'}), 400
+        season = Season.query.filter_by(id=season_id, farmer_id=farmer.id).first() if season_id else farmer.current_season
+        if not season:
+            return jsonify({'message': 'Season not found'}), 404
+
+        if season.is_archived:
+            rows = archived_contracts(season_records(season))[::-1]
+            if before:
+                rows = [c for c in rows if (c.timestamp, c.id) < (before_date, before_id)]
+            rows = rows[:limit + 1]
+        else:
+            query = Contract.query.filter_by(season_id=season.id)
+            if before:
+                query = query.filter(or_(Contract.timestamp < before_date, and_(Contract.timestamp == before_date, Contract.id < before_id)))
+            rows = query.order_by(Contract.timestamp.desc(), Contract.id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last.timestamp.isoformat()}_{last.id}"
+        return jsonify({
+            'season_id': season.id,
+            'contracts': [contract_entry(c) for c in rows[:limit]],
+            'next_cursor': next_cursor
+        })
+
+    @app.route('/api/farmers/status', methods=['GET'])
+    def get_farmers_status_batch():
+        """
+        Status of many farmers at once (?ids=1,2,3, up to MAX_BATCH_STATUS_IDS), in the same per-farmer shape as
+        /api/farmer/<id>/status. Relationships are loaded with a fixed number of IN queries whatever the id count.
+        """
+        try:
+            ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+            fields = parse_fields(request.args.get('fields'), FARMER_STATUS_FIELDS)
+        except ValueError as e:
+            return jsonify({'message': f'Invalid request: {e}'}), 400
+        if not ids:
+            return jsonify({'message': 'ids is required (comma-separated farmer ids).'}), 400
+        if len(ids) > MAX_BATCH_STATUS_IDS:
+            return jsonify({'message': f'At most {MAX_BATCH_STATUS_IDS} ids per request.'}), 400
+
+        farmers = {f.id: f for f in Farmer.query.filter(Farmer.id.in_(ids)).options(*farmer_status_load_options(fields))}
+        seasons = {farmer_id: farmers[farmer_id].current_season for farmer_id in ids if farmer_id in farmers}
+        recent = {}
+        if fields is None or fields & {'contract_state', 'contract_hash', 'contract_history'}:
+            hot_ids = [s.id for s in seasons.values() if s and not s.is_archived]
+            recent = latest_contracts_by_season(hot_ids, CONTRACT_HISTORY_EMBED) if hot_ids else {}
+        results, missing = [], []
+        for farmer_id in ids:
+            season = seasons.get(farmer_id)
+            if not season:
+                missing.append(farmer_id)
+                continue
+            results.append(build_farmer_status(farmers[farmer_id], season, fields, recent.get(season.id)))
+        return jsonify({'farmers': results, 'missing': missing})
+
     @app.route('/api/admin/farmers', methods=['GET'])
     def get_all_farmers():
-        farmers = Farmer.query.all()
+        try:
+            fields = parse_fields(request.args.get('fields'), ADMIN_FARMER_FIELDS) or set(ADMIN_FARMER_FIELDS)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        # Seasons are only resolved (and then eager-loaded in bulk) when a season-derived field is selected
+        needs_stages = bool(fields & {'stages', 'stages_completed'})
+        needs_season = needs_stages or 'score' in fields
+        query = Farmer.query
+        if needs_season:
+            seasons = selectinload(Farmer.seasons)
+            options = [seasons.selectinload(Season.summary)]
+            if needs_stages:
+                options.append(seasons.selectinload(Season.stages))
+            if 'score' in fields:
+                options.append(seasons.selectinload(Season.scorecards))
+            query = query.options(*options)
+        farmers = query.all()
         farmer_list = []
         for f in farmers:
-            season = f.current_season
-            stages_completed = sum(1 for s in season.stages if s.status == 'COMPLETED') if season else 0
-            score = f.current_status['score']
-            farmer_list.append({
-                'id': f.id,
-                'name': f.name,
-                'phone': f.phone,
-                'stages_completed': stages_completed,
-                'score': score,
-                'stages': [
-                    {
-                        'stage_number': s.stage_number,
-                        'status': s.status,
-                        'stage_name': s.stage_name # Including name for good measure
-                    }
-                    for s in season.stages
-                ] if season and season.stages else []
-            })
+            season = f.current_season if needs_season else None
+            item = {}
+            if 'id' in fields:
+                item['id'] = f.id
+            if 'name' in fields:
+                item['name'] = f.name
+            if 'phone' in fields:
+                item['phone'] = f.phone
+            if 'stages_completed' in fields or 'stages' in fields:
+                stages = season_records(season)['stages'] if season else []
+                if 'stages_completed' in fields:
+                    item['stages_completed'] = sum(1 for s in stages if s.status == 'COMPLETED')
+                if 'stages' in fields:
+                    item['stages'] = [
+                        {
+                            'stage_number': s.stage_number,
+                            'status': s.status,
+                            'stage_name': s.stage_name # Including name for good measure
+                        }
+                        for s in stages
+                    ]
+            if 'score' in fields:
+                item['score'] = season_score(season)
+            farmer_list.append(item)
 
         return jsonify(farmer_list)
 
     @app.route('/api/farmer/<int:farmer_id>/upload', methods=['POST'])
+    @idempotent
     def upload_file(farmer_id):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -395,6 +2014,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
 
         data = request.get_json()
         stage_number = data['stage_number']
@@ -407,46 +2028,142 @@ def create_app(test_config=None):
         if not stage or stage.status != 'UNLOCKED':
             return jsonify({'message': f'Stage {stage_number} is not ready for upload.\nStatus: {stage.status if stage else "N/A"}'}), 400
 
-        # 1. Mock File Upload
-        upload = FileUpload(
-            farmer_id=farmer_id,
-            season_id=season.id,
-            stage_number=stage_number,
-            file_type=file_type,
-            file_name=file_name
+        record_stage_upload(season, stage, file_type, file_name, soil_data)
+        db.session.commit()
+        return jsonify({'message': f'Upload successful for Stage {stage_number}.\nStatus updated to PENDING Field Officer approval.'})
+
+    def upload_progress(session, offset, status=200, **extra):
+        """Resume state of an upload, in the body and as tus-style Upload-Offset/Upload-Length headers."""
+        response = jsonify({'upload_id': session.id, 'offset': offset, 'size': session.size, 'complete': False, **extra})
+        response.headers['Upload-Offset'] = str(offset)
+        response.headers['Upload-Length'] = str(session.size)
+        return response, status
+
+    @app.route('/api/farmer/<int:farmer_id>/uploads', methods=['POST'])
+    @idempotent
+    def create_upload(farmer_id):
+        """
+        Starts a resumable evidence upload for an UNLOCKED stage. Send the bytes with PATCH /api/uploads/<id>.
+        The bytes are always required, even when the declared sha256 is already stored: a digest alone does not
+        prove possession of the file. Identical content is still stored once when the upload completes.
+        """
+        farmer = Farmer.query.get(farmer_id)
+        if not farmer:
+            return jsonify({'message': 'Farmer not found'}), 404
+        season = farmer.current_season
+        if not season:
+            return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
+
+        data = request.get_json() or {}
+        try:
+            stage_number = int(data['stage_number'])
+            file_type = data['file_type']
+            size = int(data['size'])
+            sha256 = bytes.fromhex(data['sha256']) if data.get('sha256') else None
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'message': 'stage_number, file_type and size are required; sha256 must be hex.'}), 400
+        if not 0 < size <= UPLOAD_MAX_FILE_SIZE:
+            return jsonify({'message': f'size must be between 1 and {UPLOAD_MAX_FILE_SIZE} bytes.'}), 413
+        if sha256 is not None and len(sha256) != 32:
+            return jsonify({'message': 'sha256 must be 64 hex characters.'}), 400
+
+        stage = LoanStage.query.filter_by(season_id=season.id, stage_number=stage_number).first()
+        if not stage or stage.status != 'UNLOCKED':
+            return jsonify({'message': f'Stage {stage_number} is not ready for upload.\nStatus: {stage.status if stage else "N/A"}'}), 400
+
+        session = UploadSession(
+            id=uuid.uuid4().hex, farmer_id=farmer.id, season_id=season.id, stage_number=stage_number, file_type=file_type,
+            file_name=data.get('file_name'), size=size, sha256=sha256, soil_data=data.get('soil_data')
         )
-        db.session.add(upload)
-
-        # 2. Update Stage Status
-        stage.status = 'PENDING'
-
-        # 3. Handle Soil Test Data (Mock Scoring Update)
-        if file_type == 'soil_test' and soil_data:
-            # Mock Soil Quality Scoring: Higher pH/nutrients give better mock score
-            soil_score_boost = 0
-            if soil_data.get('ph', 6) > 6.5:
-                soil_score_boost += 5
-            # Re-calculate score and update scorecard
-            scorecard = season.scorecards[-1] if season.scorecards else None
-            if scorecard:
-                scorecard.xai_factors = scorecard.xai_factors or []
-                # Find and update the "Soil Quality Score (Mock)" factor
-                for factor in scorecard.xai_factors:
-                    if factor.get('factor') == 'Soil Quality Score (Mock)':
-                        factor['weight'] = factor.get('weight', 0) + soil_score_boost * 10
-                        break
-                new_score, new_risk, new_xai = calculate_score_and_xai(season)
-                scorecard.score = new_score
-                scorecard.risk_band = new_risk
-                scorecard.xai_factors = new_xai
-                db.session.add(scorecard)
-            transition_contract_state(season.id, f'STAGE_{stage_number}_SOIL_TEST_UPDATE', data=f'Score Boost: {soil_score_boost}')
-
-        # 4. Update Contract State
-        transition_contract_state(season.id, f'STAGE_{stage_number}_PENDING', data=f'{file_type} uploaded')
+        db.session.add(session)
+        db.session.commit()
+        response, status = upload_progress(session, 0, 201, chunk_size=UPLOAD_CHUNK_SIZE)
+        response.headers['Location'] = f'/api/uploads/{session.id}'
+        return response, status
+
+    @app.route('/api/uploads/<upload_id>', methods=['GET'])
+    def get_upload_offset(upload_id):
+        """Resume point of an upload (also answers HEAD with the Upload-Offset header only)."""
+        session = db.session.get(UploadSession, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload not found or already completed'}), 404
+        return upload_progress(session, evidence.offset(upload_id))
+
+    @app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+    def append_upload(upload_id):
+        """
+        Appends the raw request body at the Upload-Offset header. The body is streamed to disk in blocks
+        (never buffered whole) while its SHA-256 is computed. The last chunk completes the upload: the file is
+        moved to its content address, linked to a FileUpload row and to the STAGE_n_PENDING transition.
+        """
+        session = db.session.get(UploadSession, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload not found or already completed'}), 404
+        season = db.session.get(Season, session.season_id)
+        if season.is_archived:
+            return archived_season_response(season)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return jsonify({'message': 'Upload-Offset header is required.'}), 400
+        length = request.content_length
+        if length is None:
+            return jsonify({'message': 'Content-Length is required for upload chunks.'}), 411
+        remaining = session.size - offset
+        if length > UPLOAD_MAX_CHUNK_SIZE or length > remaining:
+            return jsonify({'message': f'Chunk too large: at most {min(remaining, UPLOAD_MAX_CHUNK_SIZE)} bytes accepted.'}), 413
 
+        try:
+            offset = evidence.append(upload_id, request.stream, offset, length)
+        except ValueError as e:
+            return upload_progress(session, evidence.offset(upload_id), 409, message=str(e))
+        if offset < session.size:
+            return upload_progress(session, offset)
+
+        stage = LoanStage.query.filter_by(season_id=session.season_id, stage_number=session.stage_number).first()
+        if not stage or stage.status != 'UNLOCKED':
+            return jsonify({'message': f'Stage {session.stage_number} is no longer open for upload.\nStatus: {stage.status if stage else "N/A"}'}), 409
+        try:
+            digest, size, deduplicated = evidence.finalize(upload_id, session.sha256.hex() if session.sha256 else None)
+        except ChecksumMismatch as e:
+            db.session.delete(session)
+            db.session.commit()
+            return jsonify({'message': f'{e} The upload was discarded; start again.'}), 422
+        upload = record_stage_upload(season, stage, session.file_type, session.file_name, session.soil_data,
+                                     sha256=bytes.fromhex(digest), size=size)
+        db.session.delete(session)
         db.session.commit()
-        return jsonify({'message': f'Upload successful for Stage {stage_number}.\nStatus updated to PENDING Field Officer approval.'})
+        return jsonify({
+            'upload_id': upload_id, 'offset': size, 'size': size, 'complete': True, 'file_upload_id': upload.id,
+            'sha256': digest, 'deduplicated': deduplicated,
+            'message': f'Upload successful for Stage {session.stage_number}.\nStatus updated to PENDING Field Officer approval.'
+        })
+
+    @app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+    def cancel_upload(upload_id):
+        session = db.session.get(UploadSession, upload_id)
+        if not session:
+            return jsonify({'message': 'Upload not found or already completed'}), 404
+        evidence.discard(upload_id)
+        db.session.delete(session)
+        db.session.commit()
+        return jsonify({'message': 'Upload cancelled.'})
+
+    @app.route('/api/evidence/<sha256>', methods=['GET'])
+    def get_evidence(sha256):
+        """Streams a stored evidence file by its SHA-256 (immutable content, so it can be cached forever)."""
+        sha256 = sha256.lower()
+        if len(sha256) != 64 or any(ch not in '0123456789abcdef' for ch in sha256):
+            return jsonify({'message': 'Invalid sha256'}), 400
+        upload = FileUpload.query.filter_by(sha256=bytes.fromhex(sha256)).first()
+        if not upload or not evidence.exists(sha256):
+            return jsonify({'message': 'Evidence not found'}), 404
+        response = send_file(evidence.path(sha256), download_name=upload.file_name or sha256, conditional=True, etag=sha256)
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
 
     @app.route('/api/farmer/<int:farmer_id>/trigger', methods=['POST'])
     def manual_trigger(farmer_id):
@@ -466,6 +2183,7 @@ def create_app(test_config=None):
         return jsonify({'message': f'Stage {next_stage.stage_number} requires an action (Upload/Approval) before manual trigger is relevant.'})
 
     @app.route('/api/field-officer/approve/<int:farmer_id>/<int:stage_number>/', methods=['POST'])
+    @idempotent
     def approve_stage(farmer_id, stage_number):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -473,6 +2191,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
         stage = LoanStage.query.filter_by(season_id=season.id, stage_number=stage_number, status='PENDING').first()
         if not stage:
             return jsonify({'message': f'Stage {stage_number} not found or not in PENDING status.'}), 400
@@ -480,11 +2200,12 @@ def create_app(test_config=None):
         # 1. Update Stage Status
         stage.status = 'APPROVED'
         # 2. Update Contract State
-        transition_contract_state(season.id, f'STAGE_{stage_number}_APPROVED', data='Field Officer Approval')
+        transition_contract_state(season.id, f'STAGE_{stage_number}_APPROVED', data='Field Officer Approval', commit=False)
         db.session.commit()
         return jsonify({'message': f'Stage {stage_number} approved successfully.\nReady for lender disbursement.'})
 
     @app.route('/api/lender/disburse/<int:farmer_id>/<int:stage_number>/', methods=['POST'])
+    @idempotent
     def disburse_funds(farmer_id, stage_number):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -492,6 +2213,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
         stage = LoanStage.query.filter_by(season_id=season.id, stage_number=stage_number, status='APPROVED').first()
         if not stage:
             return jsonify({'message': f'Stage {stage_number} not found or not in APPROVED status.'}), 400
@@ -500,8 +2223,8 @@ def create_app(test_config=None):
         stage.status = 'COMPLETED'
         stage.completed_date = datetime.utcnow()
 
-        # +++ ADDED AUTOMATIC POLICY CREATION ON STAGE 3 DISBURSEMENT +++
-        if stage.stage_number == 3:
+        # +++ ADDED AUTOMATIC POLICY CREATION ON INSURANCE PREMIUM DISBURSEMENT +++
+        if stage.role == STAGE_ROLE_PREMIUM:
             policy = Policy.query.filter_by(season_id=season.id).first()
             if not policy:
                 policy = Policy(
@@ -513,23 +2236,24 @@ def create_app(test_config=None):
                 db.session.add(policy)
             # Make policy active after premium disbursement
             policy.status = 'ACTIVE'
-            transition_contract_state(season.id, 'POLICY_ACTIVE', data=f'Policy {policy.policy_id} Bound after Premium Disbursement')
+            bind_policy_amounts(policy, season)
+            transition_contract_state(season.id, 'POLICY_ACTIVE', data=f'Policy {policy.policy_id} Bound after Premium Disbursement', commit=False)
 
         # Unlock Next Stage (If applicable)
         next_stage_number = stage_number + 1
         next_stage = LoanStage.query.filter_by(season_id=season.id, stage_number=next_stage_number, status='LOCKED').first()
-        # Skip the conditional Stage 5 if no pest event has been logged (Mock Logic)
-        if next_stage and next_stage.stage_number == 5 and not farmer.current_status['pest_flag']:
-            # Skip Stage 5 and unlock Stage 6
-            next_stage_number = 6
+        # Skip the conditional pest-control stage if no pest event has been logged (Mock Logic)
+        if next_stage and next_stage.role == STAGE_ROLE_PEST and not farmer.current_status['pest_flag']:
+            # Skip the pest-control stage and unlock the one after it
+            next_stage_number += 1
             next_stage = LoanStage.query.filter_by(season_id=season.id, stage_number=next_stage_number, status='LOCKED').first()
             # Log the skip in the contract transition
-            transition_contract_state(season.id, 'STAGE_5_SKIPPED', data='No Pest Event Triggered')
+            transition_contract_state(season.id, f'STAGE_{next_stage_number - 1}_SKIPPED', data='No Pest Event Triggered', commit=False)
         if next_stage:
             next_stage.status = 'UNLOCKED'
 
         # Update Contract State
-        transition_contract_state(season.id, f'STAGE_{stage_number}_COMPLETED', data=f'Disbursed ${stage.disbursement_amount}')
+        transition_contract_state(season.id, f'STAGE_{stage_number}_COMPLETED', data=f'Disbursed ${stage.disbursement_amount}', commit=False)
 
         # Re-calculate Score (Federated Learning Mock)
         score, risk_band, xai = calculate_score_and_xai(season)
@@ -542,6 +2266,7 @@ def create_app(test_config=None):
         return jsonify({'message': f'Funds disbursed for Stage {stage_number}.\nStatus updated to COMPLETED.'})
 
     @app.route('/api/field-officer/trigger_pest/<int:farmer_id>/', methods=['POST'])
+    @idempotent
     def trigger_pest_event(farmer_id):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -549,6 +2274,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
 
         # 1. Log Mock IoT Event with Pest Flag (manual officer action)
         iot_log = IoTLog(
@@ -557,36 +2284,97 @@ def create_app(test_config=None):
         )
         db.session.add(iot_log)
 
-        # 2. Force Unlock Stage 5 (Pest/Disease)
-        stage_5 = LoanStage.query.filter_by(season_id=season.id, stage_number=5).first()
-        if stage_5 and stage_5.status == 'LOCKED':
-            stage_5.status = 'UNLOCKED'
+        # 2. Force Unlock the Pest Control (Pest/Disease) stage
+        pest_stage = LoanStage.query.filter_by(season_id=season.id, role=STAGE_ROLE_PEST).first()
+        if pest_stage and pest_stage.status == 'LOCKED':
+            pest_stage.status = 'UNLOCKED'
 
         # 3. Update Contract State
-        transition_contract_state(season.id, 'PEST_EVENT_FLAGGED', data='Field Officer Mock Trigger')
+        transition_contract_state(season.id, 'PEST_EVENT_FLAGGED', data='Field Officer Mock Trigger', commit=False)
         db.session.commit()
-        return jsonify({'message': 'Pest event flagged.\nStage 5 (Pest Control) unlocked for funding.'})
+        if not pest_stage:
+            return jsonify({'message': 'Pest event flagged.\nThis crop schedule has no Pest Control stage to unlock.'})
+        return jsonify({'message': f'Pest event flagged.\nStage {pest_stage.stage_number} (Pest Control) unlocked for funding.'})
 
     # +++ NEW ENDPOINT FOR INSURER DASHBOARD TO FETCH RELEVANT FARMERS +++
     @app.route('/api/insurer/farmers', methods=['GET'])
     def get_insurer_farmers():
-        # Find farmers who have reached or passed the insurance stage (Stage 3)
-        farmers_with_insurance_stage = Farmer.query.join(Season).join(LoanStage).filter(LoanStage.stage_number >= 3).distinct().all()
+        try:
+            fields = parse_fields(request.args.get('fields'), INSURER_FARMER_FIELDS) or set(INSURER_FARMER_FIELDS)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        # Farmers whose current season has reached the insurance premium stage (no longer LOCKED) or has a policy,
+        # resolved with one grouped query instead of loading every farmer's season, policies and status
+        current = db.session.query(Season.farmer_id, func.max(Season.id).label('season_id')).group_by(Season.farmer_id).subquery()
+        premium_stage = db.session.query(LoanStage.season_id).filter(LoanStage.role == STAGE_ROLE_PREMIUM, LoanStage.status != 'LOCKED').subquery()
+        latest_policy = db.session.query(Policy.season_id, func.max(Policy.id).label('policy_id')).group_by(Policy.season_id).subquery()
+        latest_score = db.session.query(Scorecard.season_id, func.max(Scorecard.id).label('scorecard_id')).group_by(Scorecard.season_id).subquery()
+        rows = db.session.query(
+            Farmer.id, Farmer.name, Policy.status, Scorecard.score, SeasonSummary.final_score
+        ).join(current, current.c.farmer_id == Farmer.id
+        ).outerjoin(premium_stage, premium_stage.c.season_id == current.c.season_id
+        ).outerjoin(latest_policy, latest_policy.c.season_id == current.c.season_id
+        ).outerjoin(Policy, Policy.id == latest_policy.c.policy_id
+        ).outerjoin(latest_score, latest_score.c.season_id == current.c.season_id
+        ).outerjoin(Scorecard, Scorecard.id == latest_score.c.scorecard_id
+        ).outerjoin(SeasonSummary, SeasonSummary.season_id == current.c.season_id
+        ).filter(or_(premium_stage.c.season_id.isnot(None), Policy.id.isnot(None))).order_by(Farmer.id).all()
         farmer_list = []
-        for f in farmers_with_insurance_stage:
-            season = f.current_season
-            if season:
-                score = f.current_status['score']
-                policy = season.policies[-1] if season.policies else None
-                farmer_list.append({
-                    'id': f.id,
-                    'name': f.name,
-                    'policy_status': policy.status if policy else 'PENDING_GENERATION',
-                    'score': score
-                })
+        for farmer_id, name, policy_status, score, archived_score in rows:
+            item = {}
+            if 'id' in fields:
+                item['id'] = farmer_id
+            if 'name' in fields:
+                item['name'] = name
+            if 'policy_status' in fields:
+                item['policy_status'] = policy_status or 'PENDING_GENERATION'
+            if 'score' in fields:
+                item['score'] = next((v for v in (score, archived_score) if v is not None), 50)
+            farmer_list.append(item)
         return jsonify(farmer_list)
 
+    @app.route('/api/insurer/claims', methods=['GET'])
+    def get_claims_queue():
+        """
+        CLAIM_PENDING policies, oldest claim first, served from ix_policy_status_claim_date.
+        Keyset pagination: pass the returned next_cursor as ?after= to get the following page.
+        """
+        try:
+            limit = min(max(int(request.args.get('limit', CLAIMS_PAGE_SIZE)), 1), 500)
+            after = request.args.get('after')
+            if after:
+                after_date, after_id = after.rsplit('_', 1)
+                after_date, after_id = datetime.fromisoformat(after_date), int(after_id)
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or cursor.'}), 400
+
+        query = db.session.query(Policy, Season.farmer_id, Farmer.name).join(Season, Season.id == Policy.season_id
+        ).join(Farmer, Farmer.id == Season.farmer_id).outerjoin(SeasonSummary, SeasonSummary.season_id == Policy.season_id
+        ).filter(Policy.status == 'CLAIM_PENDING', SeasonSummary.season_id.is_(None))
+        if after:
+            query = query.filter(or_(Policy.claim_date > after_date, and_(Policy.claim_date == after_date, Policy.id > after_id)))
+        rows = query.order_by(Policy.claim_date, Policy.id).limit(limit + 1).all()
+
+        claims = [
+            {
+                'policy_id': policy.policy_id,
+                'farmer_id': farmer_id,
+                'name': name,
+                'season_id': policy.season_id,
+                'claim_date': policy.claim_date.isoformat() if policy.claim_date else None,
+                'sum_insured': policy.sum_insured,
+                'payout_amount': policy.payout_amount,
+                'version': policy.version
+            } for policy, farmer_id, name in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1][0]
+            next_cursor = f"{last.claim_date.isoformat()}_{last.id}"
+        return jsonify({'claims': claims, 'next_cursor': next_cursor})
+
     @app.route('/api/insurer/bind/<int:farmer_id>', methods=['POST'])
+    @idempotent
     def bind_policy(farmer_id):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -594,6 +2382,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
         policy = Policy.query.filter_by(season_id=season.id).first()
         if policy and policy.status == 'ACTIVE':
             return jsonify({'message': 'Policy is already bound and active.'}), 400
@@ -602,11 +2392,13 @@ def create_app(test_config=None):
             db.session.add(policy)
         # Mock binding process
         policy.status = 'ACTIVE'
-        transition_contract_state(season.id, 'POLICY_ACTIVE', data=f'Policy {policy.policy_id} Bound')
+        bind_policy_amounts(policy, season)
+        transition_contract_state(season.id, 'POLICY_ACTIVE', data=f'Policy {policy.policy_id} Bound', commit=False)
         db.session.commit()
         return jsonify({'message': f'Policy {policy.policy_id} bound successfully and is ACTIVE.'})
 
     @app.route('/api/insurer/trigger/<int:farmer_id>', methods=['POST'])
+    @idempotent
     def check_insurance_trigger(farmer_id):
         farmer = Farmer.query.get(farmer_id)
         if not farmer:
@@ -614,6 +2406,8 @@ def create_app(test_config=None):
         season = farmer.current_season
         if not season:
             return jsonify({'message': 'No active season found'}), 404
+        if season.is_archived:
+            return archived_season_response(season)
         data = request.get_json()
         rainfall = data.get('rainfall', 0)
         policy = Policy.query.filter_by(season_id=season.id, status='ACTIVE').first()
@@ -621,8 +2415,8 @@ def create_app(test_config=None):
             return jsonify({'message': 'No active insurance policy found to check triggers.'}), 400
         # Mock trigger check logic
         if rainfall < 10:
-            policy.status = 'CLAIM_PENDING'
-            transition_contract_state(season.id, 'INSURANCE_CLAIM_TRIGGERED', data=f'Rainfall was {rainfall}mm')
+            open_claim(policy)
+            transition_contract_state(season.id, 'INSURANCE_CLAIM_TRIGGERED', data=f'Rainfall was {rainfall}mm', commit=False)
             db.session.add(policy)
             db.session.commit()
             return jsonify({'message': 'Drought trigger met! Insurance claim process initiated.'})
@@ -630,10 +2424,12 @@ def create_app(test_config=None):
 
     # --- UPDATED IOT INGESTION: drought detection and claim trigger (safe, farmer-driven) ---
     @app.route('/api/iot/ingest', methods=['POST'])
+    @idempotent
     def ingest_iot_data():
         """
         Accepts JSON body or form data with sensor values. Accepts farmer_id as query param or in JSON.
         Detects drought (based on moisture threshold) and marks policy as CLAIM_PENDING for insurer review.
+        With IOT_WRITE_BEHIND enabled the reading is only validated and queued (202); the consumer (GENFIN_IOT_CONSUMER=1 or `flask iot-consumer`) commits it.
         """
         # Look for farmer_id in query params or JSON body
         farmer_id = request.args.get('farmer_id') or (request.get_json() or {}).get('farmer_id')
@@ -644,65 +2440,102 @@ def create_app(test_config=None):
         except:
             return jsonify({'message': 'farmer_id must be an integer.'}), 400
 
+        payload = request.get_json() or {}
+        reading = parse_iot_reading(payload)
+
+        # Write-behind mode: append to the durable queue and acknowledge; the consumer thread commits in batches
+        if iot_queue is not None:
+            if queue_depth_exceeded():
+                return jsonify({'message': 'IoT ingest queue is full, retry later.'}), 503
+            # Same checks as the synchronous path, answered from a small cache on the hot path
+            season_id, archived = current_season_of(farmer_id)
+            if season_id is None:
+                return jsonify({'message': 'Cannot ingest IoT data: Farmer or active season not found.'}), 400
+            if archived:
+                return archived_season_response(db.session.get(Season, season_id))
+            iot_queue.append(farmer_id, payload)
+            return jsonify({
+                'message': 'IoT data queued.',
+                'queued': True,
+                'drought_flag': reading['drought_detected'],
+                'moisture': reading['moisture'],
+                'temperature': reading['temperature']
+            }), 202
+
         farmer = Farmer.query.get(farmer_id)
         if not farmer or not farmer.current_season:
             return jsonify({'message': 'Cannot ingest IoT data: Farmer or active season not found.'}), 400
+        if farmer.current_season.is_archived:
+            return archived_season_response(farmer.current_season)
 
-        payload = request.get_json() or {}
-        # payload can include temperature, moisture, ph, etc.
-        temperature = payload.get('temperature')
-        moisture = payload.get('moisture')
-        ph = payload.get('ph')
-        # If incoming is CSV file (multipart form), client might send different; keep simple for demo
-        # Determine drought: simple threshold
-        drought_flag = False
-        try:
-            if moisture is not None:
-                moisture_val = float(moisture)
-                drought_flag = moisture_val < 25.0  # threshold (configurable)
-            else:
-                # If moisture missing but temperature present, use temperature heuristic (less reliable)
-                if temperature is not None:
-                    temp_val = float(temperature)
-                    drought_flag = temp_val > 35.0  # very simplistic
-        except Exception:
-            drought_flag = False
-
-        # Log IoT reading
-        log_data = {
-            'ph': ph,
-            'moisture': moisture,
-            'temperature': temperature,
-            'drought_detected': drought_flag,
-            'raw': payload,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        iot_log = IoTLog(season_id=farmer.current_season.id, data=log_data)
-        db.session.add(iot_log)
-
-        # If drought detected and a policy exists and is ACTIVE, mark claim pending
-        policy = Policy.query.filter_by(season_id=farmer.current_season.id).first()
-        if drought_flag and policy and policy.status == 'ACTIVE':
-            policy.status = 'CLAIM_PENDING'
-            db.session.add(policy)
-            transition_contract_state(farmer.current_season.id, 'INSURANCE_CLAIM_TRIGGERED', data=f'Drought detected (moisture={moisture})')
-
+        # Log IoT reading and evaluate drought/pest triggers (batch of one)
+        apply_iot_readings([(farmer.current_season.id, payload, datetime.utcnow())])
         db.session.commit()
         return jsonify({
             'message': 'IoT data ingested.',
-            'drought_flag': drought_flag,
-            'moisture': moisture,
-            'temperature': temperature
+            'drought_flag': reading['drought_detected'],
+            'moisture': reading['moisture'],
+            'temperature': reading['temperature']
         })
 
+    # Depth is only re-read from the queue file every few hundred milliseconds
+    _depth_check = {'at': 0.0, 'depth': 0}
+
+    def queue_depth_exceeded():
+        now = time.monotonic()
+        if now - _depth_check['at'] > 0.25:
+            _depth_check['depth'] = iot_queue.depth()
+            _depth_check['at'] = now
+        return _depth_check['depth'] >= app.config['IOT_QUEUE_MAX_DEPTH']
+
+    # farmer_id -> (current season id, checked at); only hot seasons are cached, so unknown ids are re-checked
+    _season_cache = OrderedDict()
+
+    def current_season_of(farmer_id):
+        """
+        (current season id, archived) of a farmer for write-behind ingest; season id is None when the farmer or
+        season does not exist. The consumer re-checks every reading when it drains the queue.
+        """
+        now = time.monotonic()
+        cached = _season_cache.get(farmer_id)
+        if cached and now - cached[1] < IOT_SEASON_CACHE_TTL:
+            return cached[0], False
+        season_id = db.session.query(func.max(Season.id)).filter(Season.farmer_id == farmer_id).scalar()
+        if season_id is None:
+            return None, False
+        if db.session.get(SeasonSummary, season_id) is not None:
+            return season_id, True
+        _season_cache[farmer_id] = (season_id, now)
+        _season_cache.move_to_end(farmer_id)
+        if len(_season_cache) > IOT_SEASON_CACHE_SIZE:
+            _season_cache.popitem(last=False)
+        return season_id, False
+
+    @app.route('/api/iot/queue/metrics', methods=['GET'])
+    def get_iot_queue_metrics():
+        metrics = {
+            'write_behind_enabled': iot_queue is not None,
+            'batch_size': app.config['IOT_BATCH_SIZE'],
+            'flush_interval': app.config['IOT_FLUSH_INTERVAL'],
+            'max_depth': app.config['IOT_QUEUE_MAX_DEPTH'],
+            'depth': iot_queue.depth() if iot_queue else 0,
+            'lag_seconds': iot_queue.lag_seconds() if iot_queue else 0.0,
+            'dead_letters': iot_queue.dead_letter_count() if iot_queue else 0,
+        }
+        metrics.update(_iot_consumer_stats)
+        return jsonify(metrics)
+
     # --- NEW: insurer review endpoint to approve/reject pending claims ---
     @app.route('/api/insurance/<int:farmer_id>/review', methods=['POST'])
+    @idempotent
     def review_claim(farmer_id):
         data = request.get_json() or {}
         action = data.get('action')  # "APPROVE" or "REJECT"
         farmer = Farmer.query.get(farmer_id)
         if not farmer or not farmer.current_season:
             return jsonify({'error': 'Farmer or season not found'}), 404
+        if farmer.current_season.is_archived:
+            return archived_season_response(farmer.current_season)
         policy = Policy.query.filter_by(season_id=farmer.current_season.id).first()
         if not policy:
             return jsonify({'message': 'No policy found for farmer.'}), 404
@@ -713,11 +2546,11 @@ def create_app(test_config=None):
         if action == 'APPROVE':
             policy.status = 'CLAIM_APPROVED'
             msg = '✅ Claim approved and payout simulated.'
-            transition_contract_state(farmer.current_season.id, 'INSURANCE_CLAIM_APPROVED', data=f'Claim approved by insurer')
+            transition_contract_state(farmer.current_season.id, 'INSURANCE_CLAIM_APPROVED', data=f'Claim approved by insurer', commit=False)
         elif action == 'REJECT':
             policy.status = 'CLAIM_REJECTED'
             msg = '❌ Claim rejected after review.'
-            transition_contract_state(farmer.current_season.id, 'INSURANCE_CLAIM_REJECTED', data=f'Claim rejected by insurer')
+            transition_contract_state(farmer.current_season.id, 'INSURANCE_CLAIM_REJECTED', data=f'Claim rejected by insurer', commit=False)
         else:
             return jsonify({'message': 'Invalid action. Use APPROVE or REJECT.'}), 400
 
@@ -732,9 +2565,13 @@ def create_app(test_config=None):
         total_loans_disbursed = db.session.query(func.count(func.distinct(LoanStage.season_id))).filter(LoanStage.status == 'COMPLETED').scalar() or 0
         total_value_disbursed = db.session.query(func.sum(LoanStage.disbursement_amount)).filter(LoanStage.status == 'COMPLETED').scalar() or 0.0
 
-        # Simulate Defaults: A season is in default if its end_date has passed and not all stages are 'COMPLETED'
-        defaulted_seasons = db.session.query(Season.id).filter(Season.end_date < datetime.utcnow()).except_(
-            db.session.query(Season.id).join(LoanStage).group_by(Season.id).having(func.count(case((LoanStage.status == 'COMPLETED', LoanStage.id))) == 7)
+        # Simulate Defaults: A season is in default if its end_date has passed and its final stage is not 'COMPLETED'
+        # (a skipped conditional stage counts as done, see season_defaulted)
+        # Only hot (non-archived) seasons are scanned; archived seasons contribute through their summary rows.
+        defaulted_seasons = db.session.query(Season.id).outerjoin(SeasonSummary).filter(
+            Season.end_date < datetime.utcnow(), SeasonSummary.season_id.is_(None)
+        ).except_(
+            db.session.query(LoanStage.season_id).group_by(LoanStage.season_id).having(func.max(case((LoanStage.status == 'COMPLETED', LoanStage.stage_number))) == func.max(LoanStage.stage_number))
         ).all()
         defaulted_season_ids = [s[0] for s in defaulted_seasons]
 
@@ -745,6 +2582,17 @@ def create_app(test_config=None):
             # Value of default is the *total potential value* of the loan, not just disbursed amount
             total_value_defaults = db.session.query(func.sum(LoanStage.disbursement_amount)).filter(LoanStage.season_id.in_(defaulted_season_ids)).scalar() or 0.0
 
+        archived_loans, archived_disbursed, archived_defaults, archived_default_value = db.session.query(
+            func.count(case((SeasonSummary.final_disbursed > 0, SeasonSummary.season_id))),
+            func.sum(SeasonSummary.final_disbursed),
+            func.count(case((SeasonSummary.defaulted.is_(True), SeasonSummary.season_id))),
+            func.sum(case((SeasonSummary.defaulted.is_(True), SeasonSummary.total_loan), else_=0.0))
+        ).one()
+        total_loans_disbursed += archived_loans or 0
+        total_value_disbursed += archived_disbursed or 0.0
+        total_defaults += archived_defaults or 0
+        total_value_defaults += archived_default_value or 0.0
+
         default_ratio = (total_defaults / total_loans_disbursed) * 100 if total_loans_disbursed > 0 else 0
 
         return jsonify({
@@ -756,23 +2604,34 @@ def create_app(test_config=None):
         })
 
 
+    @app.route('/api/lender/risk', methods=['GET'])
+    def get_portfolio_risk():
+        """Forward-looking expected loss, VaR and expected shortfall for the lender and insurer books."""
+        try:
+            scenarios = int(request.args.get('scenarios', 100_000))
+            seed = int(request.args.get('seed', 0))
+            confidence = float(request.args.get('confidence', 0.99))
+        except ValueError:
+            return jsonify({'message': 'scenarios and seed must be integers, confidence a number.'}), 400
+        if not 1 <= scenarios <= RISK_WEB_MAX_SCENARIOS or not 0 < confidence < 1:
+            return jsonify({'message': f'scenarios must be between 1 and {RISK_WEB_MAX_SCENARIOS:,} (use `flask risk-sim` for larger runs) '
+                                       'and confidence between 0 and 1.'}), 400
+        try:
+            return jsonify(simulate_portfolio_risk(scenarios=scenarios, seed=seed, confidence=confidence, max_cells=RISK_WEB_MAX_CELLS))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+
     @app.route('/api/insurer/kpis', methods=['GET'])
     def get_insurer_kpis():
         total_policies = Policy.query.filter(Policy.status != 'PENDING').count()
 
-        # Value of policies is the sum of Stage 3 (Insurance Premium) disbursements
-        total_value_policies = db.session.query(func.sum(LoanStage.disbursement_amount)).filter(LoanStage.stage_number == 3, LoanStage.status == 'COMPLETED').scalar() or 0.0
+        # Value of policies is the sum of Stage 3 (Insurance Premium) disbursements, stored on each policy
+        total_value_policies = db.session.query(func.sum(Policy.premium)).scalar() or 0.0
 
-        total_claims = Policy.query.filter(Policy.status.in_(['CLAIM_APPROVED', 'CLAIMED'])).count()
-
-        # *** MODIFIED LOGIC ***
-        # Simulate claim value: 10% of the total potential loan for each approved claim, representing a more realistic payout.
-        # The total potential loan acts as the "sum insured".
-        approved_claim_seasons = [p.season_id for p in Policy.query.filter(Policy.status.in_(['CLAIM_APPROVED', 'CLAIMED'])).all()]
-        total_value_claims = 0
-        if approved_claim_seasons:
-            total_potential_loan_for_claims = db.session.query(func.sum(LoanStage.disbursement_amount)).filter(LoanStage.season_id.in_(approved_claim_seasons)).scalar() or 0.0
-            total_value_claims = total_potential_loan_for_claims * 0.10 # Mock 70% payout of the total loan value (sum insured).
+        # Claim value: the payout stored on each approved policy (10% of the total potential loan, i.e. the sum insured)
+        total_claims, total_value_claims = db.session.query(
+            func.count(Policy.id), func.coalesce(func.sum(Policy.payout_amount), 0.0)
+        ).filter(Policy.status.in_(['CLAIM_APPROVED', 'CLAIMED'])).one()
 
         claims_loss_ratio = (total_value_claims / total_value_policies) * 100 if total_value_policies > 0 else 0
 
@@ -796,22 +2655,25 @@ def create_app(test_config=None):
             func.min(LoanStage.stage_number).label('current_stage_num')
         ).filter(LoanStage.status != 'COMPLETED').group_by(LoanStage.season_id).subquery()
 
-        # Join back to LoanStage to get the name of that stage
+        # Aggregate on the stage number; crop schedules name their stages differently
         stage_distribution_query = db.session.query(
-            LoanStage.stage_name,
-            func.count(LoanStage.season_id).label('farmer_count')
-        ).join(
-            subquery,
-            (LoanStage.season_id == subquery.c.season_id) & (LoanStage.stage_number == subquery.c.current_stage_num)
-        ).group_by(LoanStage.stage_name).order_by(LoanStage.stage_name).all()
-
-        stage_distribution = {name: count for name, count in stage_distribution_query}
-
-        sorted_stages = sorted(stage_distribution.keys(), key=lambda x: int(x.split()[1][:-1]))  # Extract '1:' -> '1'
+            subquery.c.current_stage_num,
+            func.count(subquery.c.season_id).label('farmer_count')
+        ).group_by(subquery.c.current_stage_num).order_by(subquery.c.current_stage_num).all()
+
+        # Display names only: every name the live schedules use for each current stage number
+        stage_names = {}
+        for number, name in db.session.query(subquery.c.current_stage_num, LoanStage.stage_name).join(
+                LoanStage, and_(LoanStage.season_id == subquery.c.season_id, LoanStage.stage_number == subquery.c.current_stage_num)
+        ).distinct().order_by(subquery.c.current_stage_num, LoanStage.stage_name):
+            stage_names.setdefault(number, []).append(name)
+        stage_distribution = {
+            ' / '.join(stage_names.get(number) or [f'Stage {number}']): count for number, count in stage_distribution_query
+        }
 
         # Short labels: S1, S2, etc.
-        labels = ['S' + str(int(name.split()[1][:-1])) for name in sorted_stages]
-        values = [stage_distribution[name] for name in sorted_stages]
+        labels = ['S' + str(number) for number, _ in stage_distribution_query]
+        values = [count for _, count in stage_distribution_query]
 
         # Generate matplotlib bar chart
         fig, ax = plt.subplots(figsize=(8, 4))  # Adjust size as needed
@@ -838,32 +2700,88 @@ def create_app(test_config=None):
 
 
 
+    @app.route('/api/admin/fps-model', methods=['GET'])
+    def get_fps_model_info():
+        model = get_fps_model()
+        if not model:
+            return jsonify({'message': 'No federated model trained yet; scores use the mock formula.', 'trained': False})
+        info = {k: v for k, v in model.items() if k not in ('mean', 'std')}
+        info['trained'] = True
+        return jsonify(info)
+
+    @app.route('/api/admin/stage-templates', methods=['GET'])
+    def list_stage_templates():
+        rows = StageTemplate.query.order_by(StageTemplate.crop, StageTemplate.version, StageTemplate.stage_number).all()
+        templates = {}
+        for r in rows:
+            templates.setdefault((r.crop, r.version), []).append({
+                'stage_number': r.stage_number,
+                'stage_name': r.stage_name,
+                'share': r.share,
+                'initial_status': r.initial_status,
+                'role': r.role
+            })
+        return jsonify([{'crop': crop, 'version': version, 'stages': stages} for (crop, version), stages in templates.items()])
+
+    @app.route('/api/admin/stage-templates', methods=['POST'])
+    def publish_stage_template():
+        """Publishes a new version of a crop's stage schedule. Existing seasons keep the stages they were created with."""
+        data = request.get_json() or {}
+        crop = (data.get('crop') or DEFAULT_TEMPLATE_CROP).lower()
+        stages = data.get('stages') or []
+        try:
+            parsed = sorted(
+                (int(st['stage_number']), st['stage_name'], float(st['share']), st.get('initial_status', 'LOCKED'), st.get('role') or None)
+                for st in stages
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'message': f'Invalid stage definition: {e}'}), 400
+        if not parsed:
+            return jsonify({'message': 'At least one stage is required.'}), 400
+        if len({number for number, *_ in parsed}) != len(parsed):
+            return jsonify({'message': 'Stage numbers must be unique.'}), 400
+        error = validate_stage_template(parsed)
+        if error:
+            return jsonify({'message': error}), 400
+
+        version = (db.session.query(func.max(StageTemplate.version)).filter(StageTemplate.crop == crop).scalar() or 0) + 1
+        db.session.add_all([
+            StageTemplate(crop=crop, version=version, stage_number=number, stage_name=name, share=share, initial_status=status, role=role)
+            for number, name, share, status, role in parsed
+        ])
+        db.session.commit()
+        return jsonify({'message': f'Stage template for {crop} published.', 'crop': crop, 'version': version}), 201
+
     @app.route('/api/admin/delete_farmer/<int:farmer_id>', methods=['DELETE'])
     def delete_farmer(farmer_id):
         """Admin endpoint to permanently delete a farmer and all related data."""
         try:
-        # Find the farmer
-          farmer = Farmer.query.get(farmer_id)
-          if not farmer:
-              return jsonify({'message': f'Farmer with ID {farmer_id} not found.'}), 404
-
-        # CRITICAL: Delete all related records first (cascade delete)
-        # This handles Seasons, Stages, Uploads, IoT, etc., which are often related
-        # to the farmer via foreign keys.
-
-        # Example: Deleting Seasons (assuming a one-to-many relationship)
-          Season.query.filter_by(farmer_id=farmer_id).delete()
-
-        # Delete the main farmer record
-          db.session.delete(farmer)
-          db.session.commit()
-
-          return jsonify({'message': f'✅ Farmer {farmer_id} and all related data permanently deleted.'}), 200
+            if not db.session.query(Farmer.id).filter_by(id=farmer_id).first():
+                return jsonify({'message': f'Farmer with ID {farmer_id} not found.'}), 404
+            # Set-based delete of every season-owned row, so no LoanStage/Contract/IoTLog rows are orphaned
+            erase_farmers([farmer_id])
+            return jsonify({'message': f'✅ Farmer {farmer_id} and all related data permanently deleted.'}), 200
+        except Exception as error:
+            print(f"Error during farmer deletion: {error}", file=sys.stderr)
+            return jsonify({'message': 'Internal Server Error during deletion.', 'error_details': str(error)}), 500
 
+    @app.route('/api/admin/erase_farmers', methods=['POST'])
+    def erase_farmers_bulk():
+        """Bulk POPIA erasure. Body: {"farmer_ids": [...], "mode": "delete"|"redact", "dry_run": bool}."""
+        data = request.get_json() or {}
+        farmer_ids = data.get('farmer_ids') or []
+        mode = data.get('mode', 'delete')
+        if mode not in ('delete', 'redact'):
+            return jsonify({'message': 'Invalid mode. Use delete or redact.'}), 400
+        try:
+            counts = erase_farmers(farmer_ids, redact=(mode == 'redact'), dry_run=bool(data.get('dry_run')),
+                                   chunk_size=int(data.get('chunk_size', ERASURE_CHUNK_SIZE)))
+        except (TypeError, ValueError) as e:
+            return jsonify({'message': f'Invalid request: {e}'}), 400
         except Exception as error:
-          db.session.rollback()
-        print(f"Error during farmer deletion: {error}", file=sys.stderr)
-        return jsonify({'message': 'Internal Server Error during deletion.', 'error_details': str(error)}), 500
+            print(f"Error during bulk erasure: {error}", file=sys.stderr)
+            return jsonify({'message': 'Internal Server Error during erasure.', 'error_details': str(error)}), 500
+        return jsonify({'mode': mode, 'dry_run': bool(data.get('dry_run')), 'counts': counts})
 
 
 
@@ -873,7 +2791,8 @@ def create_app(test_config=None):
         if not farmer or not farmer.current_season:
             return jsonify({'message': 'Farmer or active Season not found'}), 404
         season = farmer.current_season
-        scorecard = season.scorecards[-1] if season.scorecards else None
+        records = season_records(season)  # Transparently reads archived seasons from disk
+        scorecard = records['scorecards'][-1] if records['scorecards'] else None
 
         # --- PDF GENERATION LOGIC ---
         try:
@@ -918,7 +2837,7 @@ def create_app(test_config=None):
             Story.append(Paragraph("Loan Disbursement Timeline", styles['h3']))
             stage_data = [['Stage', 'Amount', 'Status', 'Date Completed']]
             total_disbursed = 0
-            for s in season.stages:
+            for s in records['stages']:
                 stage_data.append([f"Stage {s.stage_number}: {s.stage_name}", f"${s.disbursement_amount:,.2f}", s.status, s.completed_date.strftime("%Y-%m-%d") if s.completed_date else "N/A"])
                 if s.status == 'COMPLETED':
                     total_disbursed += s.disbursement_amount
@@ -939,9 +2858,8 @@ def create_app(test_config=None):
             # 4. Contract Audit Trail
             Story.append(Paragraph("Smart Contract Audit Trail (Immutable Log)", styles['h3']))
             contract_data = [['Timestamp', 'State Transition', 'Hash (First 10 Chars)']]
-            sorted_contracts = sorted(season.contracts, key=lambda c: c.timestamp)
-            for c in sorted_contracts:
-                contract_data.append([c.timestamp.strftime("%Y-%m-%d %H:%M"), c.state, c.hash_value[:10] + '...'])
+            for c in (archived_contracts(records) if season.is_archived else season.contracts):  # Already in (timestamp, id) order
+                contract_data.append([c.timestamp.strftime("%Y-%m-%d %H:%M"), c.state, c.hash_hex[:10] + '...'])
             table_contract = Table(contract_data, colWidths=[150, 150, 200])
             table_contract.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
@@ -975,9 +2893,204 @@ def create_app(test_config=None):
             print("Resetting database...", file=sys.stderr)
             db.drop_all()
             db.create_all()
+            seed_default_stage_template()
             print("✅ Database tables dropped and recreated without any mock data.", file=sys.stderr)
         # --- REMOVED MOCK FARMER CREATION TO ALLOW FOR A CLEAN DATABASE START ---
 
+    @app.cli.command('seed')
+    @click.option('--farmers', 'n_farmers', type=int, default=1000, show_default=True)
+    @click.option('--seed', type=int, default=0, show_default=True, help='Same seed (and --as-of) gives identical data.')
+    @click.option('--as-of', type=click.DateTime(), default=None, help='Reference date for season progress (default: today).')
+    @click.option('--iot-readings', type=int, default=12, show_default=True, help='Weekly IoT readings per season, at most.')
+    @click.option('--chunk-size', type=int, default=SEED_CHUNK_SIZE, show_default=True)
+    @click.option('--workers', type=int, default=None, help='Generator processes (default: CPU count).')
+    @click.option('--reset', is_flag=True, help='Drop and recreate all tables first (like init-db).')
+    def seed_command(n_farmers, seed, as_of, iot_readings, chunk_size, workers, reset):
+        """Bulk-loads a deterministic synthetic portfolio: farmers, plots, seasons, contract chains, scores, policies and IoT logs."""
+        if reset:
+            db.drop_all()
+            db.create_all()
+            seed_default_stage_template()
+        started = time.perf_counter()
+        as_of = seed_portfolio(n_farmers, seed=seed, as_of=as_of, chunk_size=chunk_size, iot_readings=iot_readings, workers=workers)
+        print(f"✅ Seeded {n_farmers} farmers (seed={seed}, as-of={as_of.date()}) in {time.perf_counter() - started:.1f}s.", file=sys.stderr)
+
+    @app.cli.command('purge-idempotency-keys')
+    def purge_idempotency_keys_command():
+        """Deletes Idempotency-Key records older than IDEMPOTENCY_TTL (their results are no longer replayed)."""
+        cutoff = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL)
+        deleted = IdempotencyRecord.query.filter(IdempotencyRecord.created_date < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        print(f"✅ Purged {deleted} expired idempotency record(s).", file=sys.stderr)
+
+    @app.cli.command('erase-farmers')
+    @click.option('--ids', default='', help='Comma-separated farmer ids.')
+    @click.option('--ids-file', type=click.File('r'), default=None, help='File with one farmer id per line.')
+    @click.option('--redact', is_flag=True, help='Redact PII but keep seasons and the contract hash chain.')
+    @click.option('--dry-run', is_flag=True, help='Only count the rows that would be affected.')
+    @click.option('--chunk-size', type=int, default=ERASURE_CHUNK_SIZE, show_default=True)
+    def erase_farmers_command(ids, ids_file, redact, dry_run, chunk_size):
+        """Erases (or redacts) farmers for POPIA requests using chunked set-based statements."""
+        farmer_ids = [i for i in ids.split(',') if i.strip()]
+        if ids_file:
+            farmer_ids += [line.strip() for line in ids_file if line.strip()]
+        counts = erase_farmers(farmer_ids, redact=redact, dry_run=dry_run, chunk_size=chunk_size)
+        verb = 'would be affected' if dry_run else ('redacted' if redact else 'deleted')
+        for table, count in counts.items():
+            print(f"{table}: {count} row(s) {verb}", file=sys.stderr)
+
+    @app.cli.command('fl-train')
+    @click.option('--rounds', type=int, default=30, show_default=True)
+    @click.option('--clients', type=int, default=4, show_default=True, help='Synthetic cooperatives for farmers without one.')
+    @click.option('--workers', type=int, default=None, help='Client processes (default: CPU count).')
+    @click.option('--local-epochs', type=int, default=5, show_default=True)
+    def fl_train_command(rounds, clients, workers, local_epochs):
+        """Trains the FPS model with federated averaging over cooperative clients and persists it for scoring."""
+        partitions = build_federated_partitions(default_clients=clients)
+        if not partitions:
+            print("No closed seasons to learn from; keeping the current scoring model.", file=sys.stderr)
+            return
+        with federated.FederatedTrainer(list(partitions.values()), workers=workers, local_epochs=local_epochs) as trainer:
+            started = time.perf_counter()
+            trainer.train(rounds)
+            elapsed = time.perf_counter() - started
+            model = trainer.to_model(rounds)
+        model['cooperatives'] = sorted(partitions)
+        federated.save_model(model, FPS_MODEL_PATH)
+        print(f"✅ Trained on {model['samples']} seasons from {model['clients']} cooperatives in {elapsed:.2f}s "
+              f"(train accuracy {model['train_accuracy']:.3f}). Saved to {FPS_MODEL_PATH}.", file=sys.stderr)
+
+    @app.cli.command('fl-bench')
+    @click.option('--clients', default='2,4,8', show_default=True, help='Comma-separated client counts.')
+    @click.option('--workers', default=','.join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})), show_default=True, help='Comma-separated worker counts.')
+    @click.option('--rounds', type=int, default=20, show_default=True)
+    @click.option('--rows', type=int, default=2000, show_default=True, help='Synthetic rows per client.')
+    def fl_bench_command(clients, workers, rounds, rows):
+        """Benchmarks federated rounds per second against the number of clients and worker processes."""
+        results = federated.benchmark([int(n) for n in clients.split(',')], [int(n) for n in workers.split(',')], rounds=rounds, rows_per_client=rows)
+        print(f"{'clients':>8} {'workers':>8} {'rounds/s':>10} {'accuracy':>9}")
+        for r in results:
+            print(f"{r['clients']:>8} {r['workers']:>8} {r['rounds_per_sec']:>10} {r['accuracy']:>9}")
+
+    @app.cli.command('bench-json')
+    @click.option('--farmer-id', type=int, default=None, help='Farmer whose status is requested (default: first farmer).')
+    @click.option('--requests', 'n_requests', type=int, default=200, show_default=True)
+    @click.option('--fields', default='name,current_status', show_default=True, help='Projection compared against the full payload.')
+    def bench_json_command(farmer_id, n_requests, fields):
+        """Benchmarks bytes and milliseconds per status/list response for each encoder, with and without ?fields=."""
+        farmer_id = farmer_id or db.session.query(func.min(Farmer.id)).scalar()
+        if farmer_id is None:
+            print("No farmers in the database; register one first.", file=sys.stderr)
+            return
+        providers = [('default', DefaultJSONProvider(app))]
+        if orjson is not None:
+            providers.append(('orjson', OrjsonProvider(app)))
+        urls = [f'/api/farmer/{farmer_id}/status', f'/api/farmer/{farmer_id}/status?fields={fields}', '/api/admin/farmers', '/api/admin/farmers?fields=id,name,score']
+        original = app.json
+        client = app.test_client()
+        print(f"{'encoder':>8} {'bytes':>9} {'ms/req':>8}  url")
+        try:
+            for name, provider in providers:
+                app.json = provider
+                for url in urls:
+                    client.get(url)  # Warm-up
+                    started = time.perf_counter()
+                    for _ in range(n_requests):
+                        response = client.get(url)
+                    elapsed_ms = (time.perf_counter() - started) * 1000 / n_requests
+                    print(f"{name:>8} {len(response.data):>9} {elapsed_ms:>8.2f}  {url}")
+        finally:
+            app.json = original
+
+    @app.cli.command('bench-upload')
+    @click.option('--sizes-mb', default='16,256,1024', show_default=True, help='Comma-separated synthetic file sizes in MiB.')
+    @click.option('--chunk-mb', type=float, default=UPLOAD_CHUNK_SIZE / 1024 / 1024, show_default=True, help='Size of each PATCH chunk.')
+    @click.option('--block-kb', type=int, default=64, show_default=True, help='Streaming read/write block size.')
+    def bench_upload_command(sizes_mb, chunk_mb, block_kb):
+        """Benchmarks streaming upload throughput and peak heap use of the evidence store, including the dedup path."""
+        results = evidence_store.benchmark([float(n) for n in sizes_mb.split(',')], chunk_mb=chunk_mb, block_size=block_kb * 1024,
+                                           root=app.config['EVIDENCE_DIR'])
+        print(f"{'size MiB':>9} {'upload':>10} {'MiB/s':>8} {'peak KiB':>9} {'dedup':>6}  sha256")
+        for r in results:
+            print(f"{r['size_mb']:>9} {r['upload']:>10} {r['mb_per_sec']:>8} {r['peak_heap_kb']:>9} {str(r['deduplicated']):>6}  {r['sha256']}")
+
+    @app.cli.command('rebuild-state')
+    @click.option('--workers', type=int, default=None, help='Replay processes (default: CPU count).')
+    @click.option('--full', is_flag=True, help='Ignore snapshots and replay every season from its first contract entry.')
+    @click.option('--snapshot-interval', type=int, default=REPLAY_SNAPSHOT_INTERVAL, show_default=True,
+                  help='Snapshot a season once this many new entries were replayed.')
+    @click.option('--batch-seasons', type=int, default=REPLAY_BATCH_SEASONS, show_default=True, help='Seasons per replay job.')
+    @click.option('--show', type=int, default=20, show_default=True, help='Differences to print.')
+    @click.option('--apply', 'apply_changes', is_flag=True, help='Overwrite diverging live stage/policy fields with the replayed values.')
+    def rebuild_state_command(workers, full, snapshot_interval, batch_seasons, show, apply_changes):
+        """Rebuilds LoanStage/Policy state from the contract log and diffs it against the live tables."""
+        report = rebuild_state(workers=workers, full=full, snapshot_interval=snapshot_interval, batch_seasons=batch_seasons)
+        diffs = report['diffs']
+        print(f"Replayed {report['events']} contract entries for {report['seasons']} season(s) in {report['seconds']}s "
+              f"({report['from_snapshot']} resumed from snapshots, {report['snapshots_written']} snapshots written).", file=sys.stderr)
+        if not diffs:
+            print("✅ Live LoanStage/Policy state matches the contract log.", file=sys.stderr)
+            return
+        seasons = len({d['season_id'] for d in diffs})
+        print(f"⚠️  {len(diffs)} difference(s) in {seasons} season(s):", file=sys.stderr)
+        for d in diffs[:show]:
+            where = f"stage {d['stage_number']}" if d['table'] == 'loan_stage' else 'policy'
+            print(f"  season {d['season_id']} {where} {d['field']}: replayed={d['replayed']} live={d['live']}")
+        if len(diffs) > show:
+            print(f"  ... {len(diffs) - show} more", file=sys.stderr)
+        if apply_changes:
+            updated, skipped = apply_replayed_state(diffs)
+            print(f"✅ Updated {updated} live field(s); {skipped} missing/extra row(s) left for manual review.", file=sys.stderr)
+
+    @app.cli.command('risk-sim')
+    @click.option('--scenarios', type=int, default=1_000_000, show_default=True)
+    @click.option('--seed', type=int, default=0, show_default=True)
+    @click.option('--confidence', type=float, default=0.99, show_default=True)
+    @click.option('--workers', type=int, default=None, help='Simulation processes (default: CPU count). Results do not depend on it.')
+    def risk_sim_command(scenarios, seed, confidence, workers):
+        """Runs the portfolio Monte Carlo loss simulation with a process pool (for runs beyond the web route's cap)."""
+        started = time.perf_counter()
+        result = simulate_portfolio_risk(scenarios=scenarios, seed=seed, confidence=confidence, workers=workers)
+        elapsed = time.perf_counter() - started
+        print(f"{'book':>8} {'expected':>12} {'VaR':>12} {'ES':>12} {'max':>12}")
+        for book in ('lender', 'insurer'):
+            r = result[book]
+            print(f"{book:>8} {r['expected_loss']:>12} {r['value_at_risk']:>12} {r['expected_shortfall']:>12} {r['max_loss']:>12}")
+        print(f"✅ {scenarios} scenarios over {result['seasons']} seasons in {elapsed:.2f}s "
+              f"(snapshot {result['snapshot']}, confidence {confidence}).", file=sys.stderr)
+
+    @app.cli.command('iot-consumer')
+    def iot_consumer_command():
+        """Drains the IoT write-behind queue into the database in the foreground (a dedicated consumer process)."""
+        if iot_queue is None:
+            print("IoT write-behind is disabled; set GENFIN_IOT_WRITE_BEHIND=1.", file=sys.stderr)
+            return
+        print(f"✅ Draining {app.config['IOT_QUEUE_PATH']} (Ctrl+C to stop).", file=sys.stderr)
+        try:
+            run_iot_consumer(app, iot_queue)
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command('iot-requeue-dead-letters')
+    def iot_requeue_dead_letters_command():
+        """Puts dead-lettered IoT readings back on the write-behind queue (once the cause of the failures is fixed)."""
+        if iot_queue is None:
+            print("IoT write-behind is disabled; set GENFIN_IOT_WRITE_BEHIND=1.", file=sys.stderr)
+            return
+        print(f"✅ Requeued {iot_queue.requeue_dead_letters()} dead-lettered reading(s).", file=sys.stderr)
+
+    @app.cli.command('archive-seasons')
+    @click.option('--before', type=click.DateTime(), default=None, help='Archive seasons that ended before this date (default and latest allowed: now).')
+    @click.option('--batch-size', type=int, default=200, show_default=True)
+    @click.option('--dry-run', is_flag=True, help='Only report how many seasons would be archived.')
+    def archive_seasons_command(before, batch_size, dry_run):
+        """Moves closed seasons out of the hot tables into compressed per-season archive files."""
+        count = archive_closed_seasons(before=before, batch_size=batch_size, dry_run=dry_run)
+        if dry_run:
+            print(f"{count} closed season(s) would be archived.", file=sys.stderr)
+        else:
+            print(f"✅ Archived {count} closed season(s) to {ARCHIVE_DIR}.", file=sys.stderr)
+
     return app
 
 
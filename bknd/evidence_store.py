@@ -0,0 +1,187 @@
+# Content-addressed, resumable storage for evidence uploads (soil test reports, photos)
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+class EvidenceStore:
+    """
+    Evidence files live under `root/sha256/<2 hex>/<digest>`, so identical uploads are stored once.
+    An upload in progress is an append-only `root/partial/<upload_id>` file: each chunk is streamed from
+    the request in `block_size` blocks straight to disk while a running SHA-256 is updated, so memory
+    use does not depend on file or chunk size. The size of the partial file is the resume offset.
+    Appends, finalize and discard hold an exclusive flock on the partial file, so concurrent requests for
+    one upload are serialised across threads and worker processes alike.
+    """
+
+    def __init__(self, root, block_size=64 * 1024):
+        self.root = root
+        self.block_size = block_size
+        self._hashers = {}  # upload_id -> (offset, running sha256) for uploads appended by this process
+        os.makedirs(os.path.join(root, 'sha256'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'partial'), exist_ok=True)
+
+    def _partial_path(self, upload_id):
+        return os.path.join(self.root, 'partial', upload_id)
+
+    def path(self, digest):
+        return os.path.join(self.root, 'sha256', digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def offset(self, upload_id):
+        path = self._partial_path(upload_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """
+        Opens the partial file for appending under an exclusive flock and yields the handle. Retries when
+        another holder finalized or discarded the file while we waited, so we never write to a moved inode.
+        """
+        path = self._partial_path(upload_id)
+        while True:
+            fh = open(path, 'ab')
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                try:
+                    current = os.stat(path).st_ino == os.fstat(fh.fileno()).st_ino
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield fh
+                    return
+            finally:
+                fh.close()  # Closing releases the lock
+
+    def _hasher(self, upload_id, offset):
+        """Running hash of the first `offset` bytes; rebuilt from the partial file after a restart."""
+        cached = self._hashers.get(upload_id)
+        if cached and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        if offset:
+            with open(self._partial_path(upload_id), 'rb') as fh:
+                for block in iter(lambda: fh.read(self.block_size), b''):
+                    hasher.update(block)
+        return hasher
+
+    def append(self, upload_id, stream, offset, length):
+        """
+        Appends up to `length` bytes read from `stream` at `offset` (which must equal the stored size).
+        Returns the new offset. Bytes received before a client disconnect are kept, so the client
+        resumes from wherever the partial file ends.
+        """
+        with self._locked(upload_id) as fh:
+            # Re-read the size under the lock: another worker may have appended this chunk meanwhile
+            current = os.fstat(fh.fileno()).st_size
+            if offset != current:
+                raise ValueError(f"Offset mismatch: upload is at {current}, chunk starts at {offset}.")
+            hasher = self._hasher(upload_id, current)
+            remaining = length
+            try:
+                while remaining > 0:
+                    block = stream.read(min(self.block_size, remaining))
+                    if not block:
+                        break
+                    fh.write(block)
+                    hasher.update(block)
+                    current += len(block)
+                    remaining -= len(block)
+                fh.flush()
+            finally:
+                self._hashers[upload_id] = (current, hasher)
+            return current
+
+    def finalize(self, upload_id, expected_digest=None):
+        """
+        Moves a complete upload to its content address. Returns (digest, size, deduplicated).
+        Raises ChecksumMismatch (and discards the upload) when `expected_digest` does not match.
+        """
+        with self._locked(upload_id) as fh:
+            size = os.fstat(fh.fileno()).st_size
+            digest = self._hasher(upload_id, size).hexdigest()
+            if expected_digest and expected_digest.lower() != digest:
+                self._discard(upload_id)
+                raise ChecksumMismatch(f"SHA-256 mismatch: expected {expected_digest}, received {digest}.")
+            target = self.path(digest)
+            deduplicated = os.path.exists(target)
+            if deduplicated:
+                os.remove(self._partial_path(upload_id))
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(self._partial_path(upload_id), target)
+            self._hashers.pop(upload_id, None)
+        return digest, size, deduplicated
+
+    def _discard(self, upload_id):
+        self._hashers.pop(upload_id, None)
+        path = self._partial_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def discard(self, upload_id):
+        with self._locked(upload_id):
+            self._discard(upload_id)
+
+
+class _RandomStream:
+    """File-like source of `size` pseudo-random bytes, generated block by block (never held in memory)."""
+
+    def __init__(self, size, seed=0):
+        self.remaining = size
+        self._block = hashlib.sha256(str(seed).encode()).digest() * 2048  # 64 KiB pattern
+        self._counter = 0
+
+    def read(self, n):
+        n = min(n, self.remaining)
+        if n <= 0:
+            return b''
+        self._counter += 1
+        data = self._counter.to_bytes(8, 'little') + self._block * (n // len(self._block) + 1)
+        data = data[:n]
+        self.remaining -= n
+        return data
+
+
+def benchmark(sizes_mb, chunk_mb=4, block_size=64 * 1024, root=None):
+    """
+    Streams synthetic files of each size through the store in `chunk_mb` chunks, then uploads the same
+    content again to measure the deduplicated path. Reports throughput and peak Python heap usage.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=root) as tmp:
+        store = EvidenceStore(tmp, block_size=block_size)
+        for size_mb in sizes_mb:
+            size = int(size_mb * 1024 * 1024)
+            chunk = max(1, int(chunk_mb * 1024 * 1024))
+            for attempt in ('first', 'duplicate'):
+                upload_id = f'bench-{size_mb}-{attempt}'
+                stream = _RandomStream(size, seed=size_mb)
+                tracemalloc.start()
+                started = time.perf_counter()
+                offset = 0
+                while offset < size:
+                    offset = store.append(upload_id, stream, offset, min(chunk, size - offset))
+                digest, _, deduplicated = store.finalize(upload_id)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append({
+                    'size_mb': size_mb,
+                    'upload': attempt,
+                    'mb_per_sec': round(size_mb / elapsed, 1) if elapsed else None,
+                    'peak_heap_kb': round(peak / 1024, 1),
+                    'deduplicated': deduplicated,
+                    'sha256': digest[:16],
+                })
+    return results
@@ -0,0 +1,221 @@
+# Federated-averaging simulation for the Farmer Proficiency Score (FPS) model
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Feature order of the FPS logistic model
+FEATURE_NAMES = [
+    "Land Size (Acres)",
+    "Age",
+    "Young Farmer (<40)",
+    "Soil Test Uploaded",
+    "Pest Event Logged",
+    "Drought Reading Logged",
+]
+
+# Per-process views onto the shared-memory blocks: {key: (SharedMemory, ndarray)}
+_shared = {}
+
+
+def _attach(layout):
+    """Process-pool initializer: maps the shared blocks into this worker without copying."""
+    for key, (name, shape) in layout.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def _local_update(client, start, end, epochs, lr, l2):
+    """
+    Runs `epochs` steps of full-batch gradient descent on one client's rows, starting from the
+    current global weights, and writes the result into that client's row of the update block.
+    Only the small argument tuple is pickled; data and weights stay in shared memory.
+    """
+    X = _shared['X'][1][start:end]
+    y = _shared['y'][1][start:end]
+    w = _shared['global'][1].copy()
+    n = max(1, end - start)
+    for _ in range(epochs):
+        p = _sigmoid(X @ w[:-1] + w[-1])
+        err = p - y
+        grad_w = X.T @ err / n + l2 * w[:-1]
+        grad_b = err.mean() if end > start else 0.0
+        w[:-1] -= lr * grad_w
+        w[-1] -= lr * grad_b
+    _shared['updates'][1][client] = w
+    return client
+
+
+class FederatedTrainer:
+    """
+    Simulates FedAvg across cooperative clients. Client partitions, the global weights and the
+    per-client updates live in shared-memory blocks; each round the clients train locally in a
+    process pool and the server combines their updates weighted by client size.
+    """
+
+    def __init__(self, partitions, workers=None, local_epochs=5, lr=0.5, l2=1e-3):
+        partitions = [(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64)) for X, y in partitions if len(y)]
+        if not partitions:
+            raise ValueError("Federated training needs at least one client with data.")
+        self.n_features = partitions[0][0].shape[1]
+        self.local_epochs = local_epochs
+        self.lr = lr
+        self.l2 = l2
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+
+        # Feature scaling from per-client sufficient statistics (count, sum, sum of squares)
+        count = sum(len(y) for _, y in partitions)
+        total = sum(X.sum(axis=0) for X, _ in partitions)
+        total_sq = sum((X ** 2).sum(axis=0) for X, _ in partitions)
+        self.mean = total / count
+        self.std = np.sqrt(np.maximum(total_sq / count - self.mean ** 2, 0.0))
+        self.std[self.std == 0] = 1.0
+
+        self.sizes = np.array([len(y) for _, y in partitions], dtype=np.float64)
+        self.ranges = []
+        offset = 0
+        for _, y in partitions:
+            self.ranges.append((offset, offset + len(y)))
+            offset += len(y)
+
+        self._blocks = {}
+        self._arrays = {}
+        self._alloc('X', (count, self.n_features))
+        self._alloc('y', (count,))
+        self._alloc('global', (self.n_features + 1,))
+        self._alloc('updates', (len(partitions), self.n_features + 1))
+        for (start, end), (X, y) in zip(self.ranges, partitions):
+            self._arrays['X'][start:end] = (X - self.mean) / self.std
+            self._arrays['y'][start:end] = y
+        self._arrays['global'][:] = 0.0
+        self._pool = None
+
+    def _alloc(self, key, shape):
+        size = max(1, int(np.prod(shape))) * np.dtype(np.float64).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks[key] = shm
+        self._arrays[key] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+    def _layout(self):
+        return {key: (shm.name, self._arrays[key].shape) for key, shm in self._blocks.items()}
+
+    def __enter__(self):
+        layout = self._layout()
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_attach, initargs=(layout,))
+        else:
+            # Single worker: train in-process against the same shared blocks
+            _shared.update({key: (self._blocks[key], self._arrays[key]) for key in self._blocks})
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+        for key in list(self._blocks):
+            _shared.pop(key, None)
+        self._arrays.clear()
+        for shm in self._blocks.values():
+            shm.close()
+            shm.unlink()
+        self._blocks.clear()
+
+    def run_round(self):
+        jobs = [(client, start, end, self.local_epochs, self.lr, self.l2) for client, (start, end) in enumerate(self.ranges)]
+        if self._pool:
+            list(self._pool.map(_local_update, *zip(*jobs)))
+        else:
+            for job in jobs:
+                _local_update(*job)
+        # FedAvg: average client weights, weighted by the number of local samples
+        self._arrays['global'][:] = (self.sizes[:, None] * self._arrays['updates']).sum(axis=0) / self.sizes.sum()
+
+    def train(self, rounds):
+        for _ in range(rounds):
+            self.run_round()
+        return self.weights
+
+    @property
+    def weights(self):
+        return self._arrays['global'].copy()
+
+    def accuracy(self):
+        X, y, w = self._arrays['X'], self._arrays['y'], self._arrays['global']
+        return float(((_sigmoid(X @ w[:-1] + w[-1]) >= 0.5) == (y >= 0.5)).mean())
+
+    def to_model(self, rounds):
+        w = self.weights
+        return {
+            'features': FEATURE_NAMES[:self.n_features],
+            'coef': w[:-1].tolist(),
+            'intercept': float(w[-1]),
+            'mean': self.mean.tolist(),
+            'std': self.std.tolist(),
+            'clients': len(self.ranges),
+            'samples': int(self.sizes.sum()),
+            'rounds': rounds,
+            'train_accuracy': self.accuracy(),
+            'trained_at': datetime.utcnow().isoformat(),
+        }
+
+
+def save_model(model, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump(model, fh)
+    os.replace(tmp_path, path)
+
+
+def load_model(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def predict(model, features):
+    """Returns (probability of success, per-feature logit contributions) for one feature vector."""
+    x = (np.asarray(features, dtype=np.float64) - np.asarray(model['mean'])) / np.asarray(model['std'])
+    contributions = np.asarray(model['coef']) * x
+    return float(_sigmoid(contributions.sum() + model['intercept'])), contributions.tolist()
+
+
+def synthetic_partitions(n_clients, rows_per_client, seed=0):
+    """Random client partitions with a known logistic ground truth, used by the benchmark."""
+    rng = np.random.default_rng(seed)
+    true_w = rng.normal(size=len(FEATURE_NAMES))
+    partitions = []
+    for _ in range(n_clients):
+        X = rng.normal(size=(rows_per_client, len(FEATURE_NAMES)))
+        y = (rng.random(rows_per_client) < _sigmoid(X @ true_w)).astype(np.float64)
+        partitions.append((X, y))
+    return partitions
+
+
+def benchmark(client_counts, worker_counts, rounds=20, rows_per_client=2000, local_epochs=5):
+    """Measures FedAvg rounds per second for each (clients, workers) combination."""
+    results = []
+    for n_clients in client_counts:
+        partitions = synthetic_partitions(n_clients, rows_per_client)
+        for workers in worker_counts:
+            with FederatedTrainer(partitions, workers=workers, local_epochs=local_epochs) as trainer:
+                trainer.run_round()  # Warm-up: starts the pool workers
+                started = time.perf_counter()
+                trainer.train(rounds)
+                elapsed = time.perf_counter() - started
+                results.append({
+                    'clients': n_clients,
+                    'workers': workers,
+                    'rounds_per_sec': round(rounds / elapsed, 2),
+                    'accuracy': round(trainer.accuracy(), 3),
+                })
+    return results
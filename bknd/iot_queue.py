@@ -0,0 +1,145 @@
+# Durable write-behind queue for single-reading IoT ingest
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class IoTWriteBehindQueue:
+    """
+    Append-only queue of raw IoT readings stored in a separate SQLite file in WAL mode.
+    The ingest endpoint appends and acknowledges immediately; a consumer claims batches,
+    writes them to the main database and then acks (deletes) them. Claims that are not
+    acked within `claim_timeout` seconds (e.g. the consumer crashed) become visible again,
+    so every reading is processed at least once. Each claim counts as an attempt; a reading
+    that has been claimed `max_attempts` times without an ack is moved to `iot_dead_letter`
+    instead of being retried, so one poison batch cannot block the readings queued behind it.
+    """
+
+    def __init__(self, path, claim_timeout=60.0, max_attempts=5):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # FULL fsyncs the WAL on every commit, so an acknowledged (202) reading survives an OS crash or power loss
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS iot_queue ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' farmer_id INTEGER NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' received_at REAL NOT NULL,'
+            ' claimed_at REAL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0)'
+        )
+        # Queue files created before the attempt counter existed
+        if 'attempts' not in {row[1] for row in self._conn.execute('PRAGMA table_info(iot_queue)')}:
+            self._conn.execute('ALTER TABLE iot_queue ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS iot_dead_letter ('
+            ' id INTEGER PRIMARY KEY,'
+            ' farmer_id INTEGER NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' received_at REAL NOT NULL,'
+            ' attempts INTEGER NOT NULL,'
+            ' error TEXT,'
+            ' failed_at REAL NOT NULL)'
+        )
+
+    def append(self, farmer_id, payload, received_at=None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO iot_queue (farmer_id, payload, received_at) VALUES (?, ?, ?)',
+                (farmer_id, json.dumps(payload), received_at or time.time())
+            )
+
+    def claim(self, limit):
+        """Claims up to `limit` of the oldest unclaimed readings. Returns [(id, farmer_id, payload, received_at)]."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Expired claims that used up their attempts (the consumer died on them) are not handed out again
+                self._dead_letter('claimed_at < ? AND attempts >= ?', (now - self.claim_timeout, self.max_attempts), 'claim timed out', now)
+                rows = self._conn.execute(
+                    'SELECT id, farmer_id, payload, received_at FROM iot_queue'
+                    ' WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT ?',
+                    (now - self.claim_timeout, limit)
+                ).fetchall()
+                if rows:
+                    self._conn.executemany('UPDATE iot_queue SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?', [(now, r[0]) for r in rows])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [(r[0], r[1], json.loads(r[2]), r[3]) for r in rows]
+
+    def ack(self, ids):
+        with self._lock:
+            self._conn.executemany('DELETE FROM iot_queue WHERE id = ?', [(i,) for i in ids])
+
+    def release(self, ids, error=None):
+        """
+        Makes claimed readings visible again after a failed batch. Readings that have reached
+        `max_attempts` are moved to the dead-letter table instead; returns how many were.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                dead = sum(self._dead_letter('id = ? AND attempts >= ?', (i, self.max_attempts), error, now) for i in ids)
+                self._conn.executemany('UPDATE iot_queue SET claimed_at = NULL WHERE id = ?', [(i,) for i in ids])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return dead
+
+    def _dead_letter(self, where, params, error, now):
+        """Moves the queued readings matching `where` to iot_dead_letter. Call inside a transaction."""
+        moved = self._conn.execute(
+            'INSERT INTO iot_dead_letter (id, farmer_id, payload, received_at, attempts, error, failed_at)'
+            f' SELECT id, farmer_id, payload, received_at, attempts, ?, ? FROM iot_queue WHERE {where}',
+            (error, now) + tuple(params)
+        ).rowcount
+        if moved:
+            self._conn.execute(f'DELETE FROM iot_queue WHERE {where}', params)
+        return moved
+
+    def requeue_dead_letters(self):
+        """Puts every dead-lettered reading back on the queue with a fresh attempt count (after a fix). Returns the count."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                count = self._conn.execute(
+                    'INSERT INTO iot_queue (id, farmer_id, payload, received_at)'
+                    ' SELECT id, farmer_id, payload, received_at FROM iot_dead_letter'
+                ).rowcount
+                self._conn.execute('DELETE FROM iot_dead_letter')
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return count
+
+    def dead_letter_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM iot_dead_letter').fetchone()[0]
+
+    def depth(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM iot_queue').fetchone()[0]
+
+    def lag_seconds(self):
+        """Age of the oldest queued reading, i.e. how far the consumer is behind ingest."""
+        with self._lock:
+            oldest = self._conn.execute('SELECT MIN(received_at) FROM iot_queue').fetchone()[0]
+        return round(time.time() - oldest, 3) if oldest else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
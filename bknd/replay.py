@@ -0,0 +1,121 @@
+# Event replay: folds a season's contract log into its LoanStage/Policy state
+import re
+from datetime import datetime
+
+# Bump when the fold rules change; snapshots written by another version are ignored
+ENGINE_VERSION = 2
+
+_STAGE_EVENT = re.compile(r'^STAGE_(\d+)_(PENDING|APPROVED|COMPLETED|SKIPPED|SOIL_TEST_UPDATE)$')
+
+
+def initial_state(initial_statuses, pest_stage=None):
+    """
+    State of a freshly registered season. `initial_statuses` maps stage number -> initial status from the
+    season's stage template and `pest_stage` is the number of its pest-control stage (None when it has none).
+    The state is JSON-native (string keys, ISO timestamps) so it can be snapshotted.
+    """
+    return {
+        'stages': {str(number): {'status': status, 'completed_date': None} for number, status in initial_statuses.items()},
+        'pest_stage': pest_stage,
+        'policy': None,
+        'contract_state': None,
+        'skip_stage': None,
+    }
+
+
+def apply_event(state, event, timestamp):
+    """Applies one contract transition, mirroring what the route that logged it did to the live tables."""
+    stages = state['stages']
+    state['contract_state'] = event
+    match = _STAGE_EVENT.match(event)
+    if match:
+        number, action = int(match.group(1)), match.group(2)
+        stage = stages.get(str(number))
+        if action == 'SKIPPED':
+            # Logged just before the completion that would have unlocked this (conditional) stage
+            state['skip_stage'] = number
+        elif stage is None:
+            return
+        elif action == 'PENDING':
+            stage['status'] = 'PENDING'
+        elif action == 'APPROVED':
+            stage['status'] = 'APPROVED'
+        elif action == 'COMPLETED':
+            stage['status'] = 'COMPLETED'
+            stage['completed_date'] = timestamp
+            following = number + 1
+            if state['skip_stage'] == following:
+                following += 1
+            state['skip_stage'] = None
+            next_stage = stages.get(str(following))
+            if next_stage and next_stage['status'] == 'LOCKED':
+                next_stage['status'] = 'UNLOCKED'
+        return
+
+    policy = state['policy']
+    if event == 'PEST_EVENT_FLAGGED':
+        pest_stage = stages.get(str(state['pest_stage']))
+        if pest_stage and pest_stage['status'] == 'LOCKED':
+            pest_stage['status'] = 'UNLOCKED'
+    elif event == 'POLICY_ACTIVE':
+        policy = state['policy'] = policy or {'claim_date': None}
+        policy['status'] = 'ACTIVE'
+        policy['bound_date'] = timestamp
+    elif policy is None:
+        return
+    elif event == 'INSURANCE_CLAIM_TRIGGERED':
+        policy['status'] = 'CLAIM_PENDING'
+        policy['claim_date'] = timestamp
+    elif event == 'INSURANCE_CLAIM_APPROVED':
+        policy['status'] = 'CLAIM_APPROVED'
+    elif event == 'INSURANCE_CLAIM_REJECTED':
+        policy['status'] = 'CLAIM_REJECTED'
+
+
+def fold(state, events):
+    """Applies [(event, iso timestamp)] in log order. Returns the number of events applied."""
+    count = 0
+    for event, timestamp in events:
+        apply_event(state, event, timestamp)
+        count += 1
+    return count
+
+
+def _same_time(replayed, live, tolerance):
+    if replayed is None or live is None:
+        return replayed is None and live is None
+    return abs((datetime.fromisoformat(replayed) - live).total_seconds()) <= tolerance
+
+
+def diff(state, live_stages, live_policy, tolerance=2.0):
+    """
+    Compares replayed state with the live rows: live_stages maps stage number -> (status, completed_date)
+    and live_policy is (status, bound_date, claim_date) or None. Timestamps match within `tolerance`
+    seconds because routes set them a moment before logging the transition.
+    Returns [(table, key, field, replayed, live)].
+    """
+    diffs = []
+    for number, stage in state['stages'].items():
+        live = live_stages.get(int(number))
+        if live is None:
+            diffs.append(('loan_stage', int(number), 'row', 'present', None))
+            continue
+        if stage['status'] != live[0]:
+            diffs.append(('loan_stage', int(number), 'status', stage['status'], live[0]))
+        if not _same_time(stage['completed_date'], live[1], tolerance):
+            diffs.append(('loan_stage', int(number), 'completed_date', stage['completed_date'], live[1].isoformat() if live[1] else None))
+    for number in sorted(set(live_stages) - {int(n) for n in state['stages']}):
+        diffs.append(('loan_stage', number, 'row', None, 'present'))
+
+    policy = state['policy']
+    if policy is None or live_policy is None:
+        if policy is not None or live_policy is not None:
+            diffs.append(('policy', None, 'row', 'present' if policy else None, 'present' if live_policy else None))
+        return diffs
+    status, bound_date, claim_date = live_policy
+    if policy['status'] != status:
+        diffs.append(('policy', None, 'status', policy['status'], status))
+    for field, live in (('bound_date', bound_date), ('claim_date', claim_date)):
+        if not _same_time(policy.get(field), live, tolerance):
+            diffs.append(('policy', None, field, policy.get(field), live.isoformat() if live else None))
+    return diffs
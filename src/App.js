@@ -9,6 +9,10 @@ const FAQ_IMG_SRC = "https://lh3.googleusercontent.com/d/1CA3_rgBfriiqvWZu8Ts_H-
 const GITHUB_LOGO_SRC = "https://lh3.googleusercontent.com/d/1LWLoq3-G8Sk-B9B5oB7CyWZnnrf2WxVN";  
 const REPO_URL = "https://github.com/genfinafrica/genfin-demo"; 
 const README_URL = "https://github.com/genfinafrica/genfin-demo/blob/main/README.md#genfin-demo";
+// Status keys the farmer chatbot renders (sent as ?fields= so the backend skips the rest)
+const CHATBOT_STATUS_FIELDS = 'name,current_status,stages,uploads,has_insurance,insurance_claim_status,insurance_triggered,insurance_payout_amount';
+// Entries the status payload embeds in contract_history (CONTRACT_HISTORY_EMBED in the backend)
+const CONTRACT_HISTORY_EMBED = 10;
 
 // --- UTILITY COMPONENTS ---
 
@@ -72,6 +76,36 @@ const BarChart = ({ title, data }) => {
 const FarmerDetailsCard = ({ farmer, score, risk, xaiFactors, contractHash, contractState, stages, contractHistory }) => {
     const [showXaiModal, setShowXaiModal] = useState(false);
     const [showContractModal, setShowContractModal] = useState(false);
+    const [olderContracts, setOlderContracts] = useState([]);
+    const [olderCursor, setOlderCursor] = useState(null);
+    const [hasOlderContracts, setHasOlderContracts] = useState(true);
+
+    // The status payload only embeds the latest entries; older ones are paged in from /contracts?before=.
+    // Start over whenever the embedded window moves (another farmer, or a new transition pushed one out).
+    const oldestEmbeddedId = contractHistory.length ? contractHistory[0].id : null;
+    useEffect(() => {
+        setOlderContracts([]);
+        setOlderCursor(null);
+        setHasOlderContracts(true);
+    }, [farmer.farmer_id, oldestEmbeddedId]);
+
+    const fullHistory = [...olderContracts, ...contractHistory];
+    const canLoadOlder = hasOlderContracts && contractHistory.length >= CONTRACT_HISTORY_EMBED;
+
+    const loadOlderContracts = async () => {
+        const oldest = fullHistory[0];
+        const before = olderCursor || (oldest ? `${oldest.timestamp}_${oldest.id}` : null);
+        if (!before) return;
+        try {
+            const { data } = await axios.get(`${API_BASE_URL}/api/farmer/${farmer.farmer_id}/contracts`, { params: { before } });
+            // Pages come newest first; the trail is rendered oldest first
+            setOlderContracts(prev => [...[...data.contracts].reverse(), ...prev]);
+            setOlderCursor(data.next_cursor);
+            setHasOlderContracts(Boolean(data.next_cursor));
+        } catch (error) {
+            console.error("Error loading older contract entries:", error);
+        }
+    };
 
     // Calculate Total Disbursed amount based on COMPLETED stages
     const totalDisbursed = stages.filter(s => s.status === 'COMPLETED')
@@ -146,6 +180,14 @@ const FarmerDetailsCard = ({ farmer, score, risk, xaiFactors, contractHash, cont
             {/* Contract Modal */}
             <Modal show={showContractModal} onClose={() => setShowContractModal(false)} title="Smart Contract Audit Trail">
                 <p>This is a simulated immutable log of all contract state transitions.</p>
+                {canLoadOlder && (
+                    <p>
+                        Showing the latest {fullHistory.length} entries.
+                        <button className="btn-view" onClick={loadOlderContracts} style={{ marginLeft: '10px' }}>
+                            Load older entries
+                        </button>
+                    </p>
+                )}
                 <table>
                     <thead>
                         <tr>
@@ -155,8 +197,8 @@ const FarmerDetailsCard = ({ farmer, score, risk, xaiFactors, contractHash, cont
                         </tr>
                     </thead>
                     <tbody>
-                        {contractHistory.map((entry, index) => (
-                            <tr key={index}>
+                        {fullHistory.map((entry, index) => (
+                            <tr key={entry.id ?? index}>
                                 <td>{new Date(entry.timestamp).toLocaleString()}</td>
                                 <td>{entry.state}</td>
                                 <td>{entry.hash.substring(0, 10)}...</td>
@@ -399,7 +441,8 @@ const FarmerChatbotMock = ({ setView }) => {
             return;
         }
         try {
-            const response = await axios.get(`${API_BASE_URL}/api/farmer/${id}/status`);
+            // Only request what the chatbot renders; the contract history is never loaded
+            const response = await axios.get(`${API_BASE_URL}/api/farmer/${id}/status`, { params: { fields: CHATBOT_STATUS_FIELDS } });
             const data = response.data;
             setFarmerStatus(data);
 